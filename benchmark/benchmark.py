@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# coding: utf-8
+## \file      benchmark.py
+## \author    SENOO, Ken
+## \copyright CC0
+
+'''
+# 概要
+generate.pyで生成したCSVでgnucash-import-stock.pyの変換を計測する。
+
+約定の件数ごとに，次を計測してresults.jsonlに1行ずつ追記する。
+- 段階ごとの時間: parse (読み込み)，match (信用決済履歴の結合)，sort，emit (分割の生成)，write (CSVの書き出し)
+- 全体: 別プロセスでスクリプトを実行したときの時間，1秒あたりの約定数，最大RSS
+
+段階ごとの時間は各段階の結果をリストにしてから次の段階に渡して測るので，
+実際のジェネレーターの連結よりメモリーを多く使う。全体の時間とRSSは実際の実行で測る。
+同じ条件の前回の結果があれば，比較して表示する。
+'''
+
+import argparse
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import time
+
+import common
+import generate
+
+HERE = pathlib.Path(__file__).resolve().parent
+DATA_DIR = HERE/'data'
+RESULTS = HERE/'results.jsonl'
+
+
+def version():
+    '''gitの版，gitがなければスクリプトのハッシュ値の先頭を返す。'''
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=common.ROOT,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return hashlib.md5(common.SOURCE.read_bytes()).hexdigest()[:12]
+
+
+def prepare(fills, credit, stocks, seed):
+    '''条件ごとのディレクトリーにCSVを生成する。生成済みならそのまま使う。'''
+    directory = DATA_DIR/'{}-{}-{}-{}'.format(fills, credit, stocks, seed)
+    if not (directory/'株式約定履歴.csv').exists():
+        generate.generate(directory, fills, credit, stocks, days=max(20, fills//5000), seed=seed)
+    return directory
+
+
+def stages(directory, chunk_rows):
+    '''段階ごとの時間 (秒) を測る。'''
+    gis = common.module()
+    result = {}
+    start = time.perf_counter()
+    with gis.Statement(directory/'信用決済履歴.csv', gis.PAY_SIGNATURE) as f:
+        index, ambiguous = gis.index_pay(gis.read_pay(f))
+    with gis.Statement(directory/'譲渡益税履歴.csv', gis.TAX_SIGNATURE) as f:
+        tax_index, tax = gis.read_tax(f)
+    with gis.Statement(directory/'株式約定履歴.csv', gis.TRADE_SIGNATURE) as f:
+        trade = list(gis.read_trade(f)[1])
+    result['parse'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    report = gis.new_report()
+    trade = list(gis.calc_trade(trade, index, ambiguous, report, tax_index))
+    result['match'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    trade = list(gis.tid_trade(gis.sort_trade(trade, chunk_rows)))
+    result['sort'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    trade = list(gis.track_lots(trade, gis.Lots(), report))
+    result['lots'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    calendar = gis.Calendar()
+    transactions, total = [], {}
+    for tid, row in trade:
+        if row.取引区分 in gis.SETTLEMENT_KINDS:
+            pay_date = gis.settle_date(row, calendar, report)
+            if pay_date not in total:
+                total[pay_date] = dict.fromkeys(gis.SETTLEMENT_KINDS, 0)
+            total[pay_date][row.取引区分] += row.売買代金
+        transactions.append((gis.ACCOUNTS.make_split(row, tid), row))
+    for pay_date in sorted(total):
+        transactions.append((gis.ACCOUNTS.make_settlement(pay_date, total[pay_date], tax), pay_date))
+    result['emit'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    balance = gis.Balance(gis.ACCOUNTS)
+    for rows, source in transactions:
+        balance.check(rows, source)
+    result['check'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with io.TextIOWrapper(open(os.devnull, 'wb'), encoding='cp932', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(gis.header)
+        for rows, source in transactions:
+            writer.writerows(rows)
+    result['write'] = time.perf_counter() - start
+    result['splits'] = sum(len(rows) for rows, source in transactions)
+    return result
+
+
+def end_to_end(directory):
+    '''別プロセスでスクリプトを実行し，(時間 (秒), 最大RSS (KiB)) を返す。'''
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, str(common.SCRIPT)], cwd=directory,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise RuntimeError('{}で終了コード{}'.format(directory, process.returncode))
+    return elapsed, usage.ru_maxrss
+
+
+def previous(path, condition):
+    '''同じ条件の直前の結果を返す。'''
+    last = None
+    if path.exists():
+        with path.open(encoding='utf-8') as f:
+            for line in f:
+                result = json.loads(line)
+                if all(result.get(key) == value for key, value in condition.items()):
+                    last = result
+    return last
+
+
+def main():
+    parser = argparse.ArgumentParser(description='gnucash-import-stock.pyの変換を計測する。')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+        help='約定の件数のカンマ区切り (既定値: %(default)s)')
+    parser.add_argument('--credit', type=float, default=0.8,
+        help='約定のうち信用取引の割合 (既定値: %(default)s)')
+    parser.add_argument('--stocks', type=int, default=50, help='銘柄数 (既定値: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='乱数の種 (既定値: %(default)s)')
+    parser.add_argument('--chunk-rows', type=int, default=100000,
+        help='ソート時に1回にメモリーに載せる行数 (既定値: %(default)s)')
+    parser.add_argument('--results', type=pathlib.Path, default=RESULTS,
+        help='結果を追記するファイル (既定値: %(default)s)')
+    args = parser.parse_args()
+
+    current = version()
+    for fills in map(int, args.sizes.split(',')):
+        condition = {'fills': fills, 'credit': args.credit, 'stocks': args.stocks,
+            'seed': args.seed, 'chunk_rows': args.chunk_rows}
+        directory = prepare(fills, args.credit, args.stocks, args.seed)
+        result = dict(condition, version=current,
+            date=datetime.datetime.now().isoformat(timespec='seconds'))
+        result['stages'] = stages(directory, args.chunk_rows)
+        result['total'], result['max_rss_kib'] = end_to_end(directory)
+        result['rows_per_sec'] = round(fills/result['total'])
+
+        last = previous(args.results, condition)
+        print('{fills}件: {total:.3f}秒, {rows_per_sec}件/秒, 最大RSS {max_rss_kib}KiB'.format(**result))
+        print('  ' + ', '.join('{} {:.3f}秒'.format(key, value) \
+            for key, value in result['stages'].items() if key != 'splits'))
+        if last:
+            print('  前回 ({}) との比: 全体 {:.2f}倍, 最大RSS {:.2f}倍'.format(last['version'],
+                result['total']/last['total'], result['max_rss_kib']/last['max_rss_kib']))
+        with args.results.open('a', encoding='utf-8') as f:
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    main()
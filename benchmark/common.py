@@ -0,0 +1,23 @@
+# coding: utf-8
+## \file      common.py
+## \author    SENOO, Ken
+## \copyright CC0
+
+'''
+ベンチマークのスクリプトで共有する処理。
+'''
+
+import importlib
+import pathlib
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+SCRIPT = ROOT/'gnucash-import-stock.py'
+MODULE_NAME = 'gnucash_import_stock'
+SOURCE = ROOT/MODULE_NAME/'__init__.py'
+
+
+def module():
+    '''リポジトリーのgnucash_import_stockパッケージをimportして返す。'''
+    if str(ROOT) not in sys.path: sys.path.insert(0, str(ROOT))
+    return importlib.import_module(MODULE_NAME)
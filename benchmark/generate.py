@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# coding: utf-8
+## \file      generate.py
+## \author    SENOO, Ken
+## \copyright CC0
+
+'''
+# 概要
+ベンチマーク用に，岡三オンライン証券の形式の [株式約定履歴.csv]，[信用決済履歴.csv]，
+[譲渡益税履歴.csv] を乱数で生成する。
+
+約定は営業日ごとにほぼ同数ずつ作り，信用の新規建玉と現物の買付は後の日に返済・売却する。
+返済・売却の約定には信用決済履歴と譲渡益税履歴の明細を対応させるので，
+gnucash-import-stock.pyで警告なく変換できる。
+'''
+
+import argparse
+import collections
+import datetime
+import pathlib
+import random
+
+import common
+
+TRADE_HEADER = '約定日,銘柄コード,銘柄名,市場,取引区分,預り,課税,約定数量,約定単価,手数料/諸経費等,税額,受渡日,受渡金額,決済損益'.split(',')
+PAY_HEADER = '取引区分,銘柄コード,銘柄名,市場区分,建区分,信用取引区分,預り,課税,新規建日,新規建単価,新規建代金,決済日,決済数量,決済単価,決済代金,約定差額,諸経費計,受渡日,受渡金額,決済損益,新規手数料,新規手数料(消費税),決済手数料,決済手数料(消費税),管理費,貸株料,金利,日数,逆日歩,書換料'.split(',')
+TAX_HEADER = '銘柄コード,銘柄名,累投区分,約定日,数量,受渡日,譲渡益税計算処理分類区分,商品,売却/決済金額,費用,取得/新規年月日,取得/新規金額,損益金額,譲渡益税徴収額,地方税'.split(',')
+
+## 譲渡益税の税率 (所得税は復興特別所得税を含む)
+NATIONAL_TAX_RATE = 0.15315
+LOCAL_TAX_RATE = 0.05
+
+## 金利と貸株料の年率
+INTEREST_RATE = 0.028
+LENDING_RATE = 0.011
+
+
+def signed(value):
+    return '{:+d}'.format(value) if value else '0'
+
+
+def japanese_date(date):
+    return '{}年{}月{}日'.format(*map(int, date.split('/')))
+
+
+class Generator:
+    '''
+    約定を1件ずつ作り，3つのCSVの明細の行を貯める。
+
+    建玉と現物の保有は銘柄コードごとのdequeで持ち，返済・売却は古いものから行う。
+    '''
+    def __init__(self, calendar, stocks, credit, seed):
+        self.random = random.Random(seed)
+        self.calendar = calendar
+        codes = self.random.sample(range(1300, 10000), stocks)
+        self.stocks = [(str(code), '銘柄{}'.format(code), self.random.randint(100, 9000)) \
+            for code in codes]
+        self.credit = credit
+        self.position = {kind: collections.defaultdict(collections.deque) \
+            for kind in ('現物', '買建', '売建')}
+        self.trade, self.pay, self.tax = [], [], []
+        self.profit = collections.Counter()
+
+    def price(self, base):
+        return max(1, round(base*self.random.uniform(0.97, 1.03)))
+
+    def fill(self, date):
+        code, name, base = self.random.choice(self.stocks)
+        price = self.price(base)
+        if self.random.random() < self.credit:
+            side = self.random.choice(('買建', '売建'))
+            lots = self.position[side][code]
+            if lots and self.random.random() < 0.5:
+                self.close(date, code, name, side, lots.popleft(), price)
+            else:
+                kind = '信新買' if side == '買建' else '信新売'
+                quantity = self.random.randint(1, 5)*100
+                lots.append((date, quantity, price))
+                self.trade.append([date, code, name, '東証', kind, '特定', '', quantity, \
+                    price, 0, 0, '', '', '0'])
+        else:
+            lots = self.position['現物'][code]
+            if lots and self.random.random() < 0.5:
+                self.sell(date, code, name, lots.popleft(), price)
+            else:
+                quantity = self.random.randint(1, 5)*100
+                fee, tax = self.fee(quantity*price)
+                lots.append((date, quantity, price))
+                self.trade.append([date, code, name, '東証', '現物買', '特定', '', quantity, \
+                    price, fee, tax, self.calendar.after(date, 2), quantity*price + fee + tax, '0'])
+
+    def fee(self, amount):
+        '''現物の手数料と消費税。100万円までは無料とする。'''
+        if amount <= 1000000: return 0, 0
+        return 1000, 100
+
+    def close(self, date, code, name, side, lot, price):
+        open_date, quantity, open_price = lot
+        delivery = self.calendar.after(date, 2)
+        days = max(1, (datetime.datetime.strptime(date, '%Y/%m/%d') \
+            - datetime.datetime.strptime(open_date, '%Y/%m/%d')).days)
+        if side == '買建':
+            kind, tax_kind = '信返売', '信用売決済'
+            diff = (price - open_price)*quantity
+            interest, lending = int(open_price*quantity*INTEREST_RATE*days/365), 0
+        else:
+            kind, tax_kind = '信返買', '信用買決済'
+            diff = (open_price - price)*quantity
+            interest, lending = 0, int(open_price*quantity*LENDING_RATE*days/365)
+        cost = interest + lending
+        profit = diff - cost
+
+        self.trade.append([date, code, name, '東証', kind, '特定', '申告', quantity, price, \
+            0, 0, delivery, profit, signed(profit)])
+        self.pay.append([kind, code, name, '東証', side, '一般(無期限)', '特定', '申告', \
+            open_date, open_price, open_price*quantity, date, quantity, price, price*quantity, \
+            signed(diff), cost, delivery, None, signed(profit), 0, 0, 0, 0, 0, lending, \
+            interest, days, 0, 0])
+        self.tax.append([code, name, '', date, quantity, delivery, tax_kind, '株式', \
+            price*quantity - cost if side == '買建' else open_price*quantity - cost, cost, \
+            open_date, open_price*quantity if side == '買建' else price*quantity, \
+            signed(profit), '', ''])
+        self.profit[delivery] += profit
+
+    def sell(self, date, code, name, lot, price):
+        open_date, quantity, open_price = lot
+        delivery = self.calendar.after(date, 2)
+        fee, tax = self.fee(quantity*price)
+        amount = quantity*price - fee - tax
+        profit = amount - quantity*open_price
+        self.trade.append([date, code, name, '東証', '現物売', '特定', '', quantity, price, \
+            fee, tax, delivery, amount, '0'])
+        self.tax.append([code, name, '', date, quantity, delivery, '売却', '株式', \
+            quantity*price, fee + tax, open_date, quantity*open_price, signed(profit), '', ''])
+        self.profit[delivery] += profit
+
+    def tax_total(self):
+        '''受渡日ごとの損益から譲渡益税の集計行と合計を作る。'''
+        rows, national, local = [], 0, 0
+        for date, profit in sorted(self.profit.items()):
+            if not profit: continue
+            day_national = int(abs(profit)*NATIONAL_TAX_RATE)
+            day_local = int(abs(profit)*LOCAL_TAX_RATE)
+            label = '譲渡益税徴収額' if profit > 0 else '譲渡益税還付金'
+            rows.append([label, None, None, None, None, None, None, date, None, None, None, \
+                None, None, day_national + day_local, day_local])
+            sign = 1 if profit > 0 else -1
+            national += sign*day_national
+            local += sign*day_local
+        return rows, national, local
+
+
+def write(path, preamble, header, rows):
+    '''
+    岡三オンライン証券と同じく，明細の値を全て""で囲んで書き込む。
+
+    Noneは""で囲まない空欄にする (信用決済履歴の受渡金額と譲渡益税履歴の集計行)。
+    '''
+    with open(path, 'w', newline='', encoding='cp932') as f:
+        for line in preamble:
+            f.write(line + '\n')
+        f.write(','.join(header) + '\n')
+        for row in rows:
+            f.write(','.join('' if value is None else '"{}"'.format(value) for value in row) + '\n')
+
+
+def generate(directory, fills, credit=0.8, stocks=50, days=20, start='2021/01/04', seed=0):
+    '''directoryに約定fills件分の3つのCSVを生成する。'''
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    calendar = common.module().Calendar()
+    generator = Generator(calendar, stocks, credit, seed)
+
+    dates = [start]
+    while len(dates) < days:
+        dates.append(calendar.after(dates[-1], 1))
+    for i in range(fills):
+        generator.fill(dates[i*days//fills])
+
+    period = '"{}","{}"'.format(japanese_date(dates[0]), japanese_date(dates[-1]))
+    ## 岡三オンライン証券のダウンロードと同じく，新しい約定から並べる。
+    trade, pay = generator.trade[::-1], generator.pay[::-1]
+    write(directory/'株式約定履歴.csv', ['株式約定履歴', '', \
+        '検索開始年月日,検索終了年月日,取引区分,銘柄コード,預り区分', \
+        period + ',"すべて","","すべて"', '', '明細数：{}件'.format(len(trade)), ''], \
+        TRADE_HEADER, trade)
+
+    profit = sum(int(row[19]) for row in pay)
+    write(directory/'信用決済履歴.csv', ['信用決済履歴', '', '検索開始年月日,検索終了年月日', \
+        period, '', '取引区分', '"すべて"', '', '銘柄コード', '""', '', '決済損益合計', \
+        '"{}"'.format(signed(profit)), '', '明細数：{}件'.format(len(pay)), ''], PAY_HEADER, pay)
+
+    rows, national, local = generator.tax_total()
+    write(directory/'譲渡益税履歴.csv', ['譲渡益税履歴', '', '検索開始年月日,検索終了年月日', \
+        period, '', '譲渡益税徴収額合計,所得税,地方税', \
+        '"{}","{}","{}"'.format(national + local, national, local), '', '損益合計金額', \
+        '"{}"'.format(sum(generator.profit.values())), '', \
+        '明細数：{}件'.format(len(generator.tax)), ''], TAX_HEADER, generator.tax + rows)
+    return len(trade), len(pay), len(generator.tax)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='岡三オンライン証券の形式のCSVを乱数で生成する。')
+    parser.add_argument('directory', help='出力先のディレクトリー')
+    parser.add_argument('--fills', type=int, default=1000, help='約定の件数 (既定値: %(default)s)')
+    parser.add_argument('--credit', type=float, default=0.8,
+        help='約定のうち信用取引の割合 (既定値: %(default)s)')
+    parser.add_argument('--stocks', type=int, default=50, help='銘柄数 (既定値: %(default)s)')
+    parser.add_argument('--days', type=int, default=20, help='営業日数 (既定値: %(default)s)')
+    parser.add_argument('--start', default='2021/01/04', help='最初の約定日 (既定値: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='乱数の種 (既定値: %(default)s)')
+    args = parser.parse_args()
+
+    count = generate(args.directory, args.fills, args.credit, args.stocks, args.days, \
+        args.start, args.seed)
+    print('株式約定履歴: {}件, 信用決済履歴: {}件, 譲渡益税履歴: {}件'.format(*count))
+
+
+if __name__ == '__main__':
+    main()
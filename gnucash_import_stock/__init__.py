@@ -0,0 +1,2042 @@
+# coding: utf-8
+## \file      __init__.py
+## \author    SENOO, Ken
+## \copyright CC0
+## \date      Created: 2020-08-03T17:29+09:00
+
+'''
+# 概要
+岡三オンライン証券での信用取引で発生する大量の取引を効率化するため，GnuCashへのインポート用データに変換する。
+
+コマンドラインからはgnucash-import-stock.py (cli.main) を使う。ライブラリーとしてはConverterを使う。
+importしただけではファイルを読み書きしない。
+
+[株式約定履歴.csv] と [信用決済履歴.csv] を使う。[譲渡益税履歴.csv] があれば，現物売の損益と精算の譲渡益税にも使う。
+
+# 方針
+1. [株式約定履歴.csv] を読み込む。
+2. データ取り込み時に決済代金を計算して列に持つ。
+3. 1.決済代金，2.取引区分，3.銘柄名，4.約定日，の順番にソート。
+4. [信用決済履歴.csv] を読み込む。
+5. 3と同じようにソート。
+'''
+
+'''
+## [株式約定履歴.csv]
+# 約定日	銘柄コード	銘柄名	市場	取引区分	預り	課税	約定数量	約定単価	手数料/諸経費等	税額	受渡日	受渡金額	決済損益
+# 2020/07/01	1458	楽天ＥＴＦ－日経レバレッジ指数連動型	東証	現物買	特定		50	10830	632	63	2020/07/03	542195	542195
+
+冒頭7行 (明細数) の後に列名の行
+使用データ
+- 約定日
+- 銘柄コード
+- 銘柄名
+- 取引区分
+- 約定数量
+- 約定単価
+- 手数料/諸経費等
+- 税額
+- 受渡金額
+'''
+
+'''
+## [信用決済履歴.csv]
+# 取引区分	銘柄コード	銘柄名	市場区分	建区分	信用取引区分	預り	課税	新規建日	新規建単価	新規建代金	決済日	決済数量	決済単価	決済代金	約定差額	諸経費計	受渡日	受渡金額	決済損益	新規手数料	新規手数料(消費税)	決済手数料	決済手数料(消費税)	管理費	貸株料	金利	日数	逆日歩	書換料
+# 信返売	8963	インヴィンシブル投資法人　投資証券	東証	買建	制度(6ヶ月)	特定	申告	2020/07/21	24260	727800	2020/07/21	30	24340	730200	2400	567	2020/07/27		1833	236	22	236	22	0	0	51	1	0	0
+
+冒頭16行 (決済損益合計，明細数) の後に列名の行
+
+使用データ
+- 銘柄コード
+- 銘柄名
+- 決済日
+- 決済数
+- 決済単価
+- 決済損益
+- 決済手数料
+- 決済手数料(消費税)
+- 貸株料
+- 金利
+'''
+
+'''
+## [譲渡益税履歴.csv]
+# 銘柄コード	銘柄名	累投区分	約定日	数量	受渡日	譲渡益税計算処理分類区分	商品	売却/決済金額	費用	取得/新規年月日	取得/新規金額	損益金額	譲渡益税徴収額	地方税
+# 9273	コーア商事ホールディングス		2020/10/23	100	2020/10/27	信用売決済	株式	288770	130	2020/10/20	298300	-9530
+# 譲渡益税徴収額							2020/10/27						4292	1056
+
+冒頭13行 (譲渡益税徴収額合計,所得税,地方税，損益合計金額，明細数) の後に列名の行
+受渡日ごとの集計行は銘柄コードの列に譲渡益税徴収額/譲渡益税還付金，商品の列に受渡日が入る。
+譲渡益税徴収額の列は所得税と地方税の合計。
+
+使用データ
+- 銘柄コード
+- 約定日
+- 数量
+- 譲渡益税計算処理分類区分
+- 損益金額
+- 譲渡益税徴収額
+- 地方税
+'''
+
+import bisect
+import collections
+import contextlib
+import csv
+import datetime
+import functools
+import hashlib
+import io
+import heapq
+import itertools
+import json
+import operator
+import pathlib
+import pickle
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+class ConversionError(ValueError):
+    '''
+    明細や勘定の設定，帳簿が正しくなく変換できないときに送出する例外。
+
+    メッセージは原因を表す文で，コマンドライン (cli.main) はこれを「エラー: 」を付けて表示して終了する。
+    '''
+
+
+## ダウンロード後にファイル名を変えなくていいように，*.csvの先頭のタイトルで明細を識別する。
+## 株式約定履歴と信用決済履歴が見つからなかった場合はこのファイル名を使う。譲渡益税履歴はなくてもよい。
+trade_csv = '株式約定履歴.csv'
+pay_csv = '信用決済履歴.csv'
+
+## *.csvの識別で先頭から読むバイト数。タイトル (1行目) と検索期間 (4行目) が収まる長さにする。
+SNIFF_BYTES = 256
+
+## 明細の冒頭を読むバイト数。列名の行はこの中にあるとみなす。
+# 明細部分もこの大きさのバッファーで読む。
+PREAMBLE_BYTES = 1 << 16
+
+## *.csvの識別結果のキャッシュ。ファイルのサイズと更新時刻が前回と同じなら中身を読まない。
+DISCOVERY_CACHE = '.gnucash-import-stock.json'
+
+## 外部マージソートで1回にメモリーに載せる行数。
+# これを超える行数は一時ファイルに整列済みの塊 (run) として書き出し，最後にマージする。
+SORT_CHUNK_ROWS = 100000
+
+## --incrementalで変換済みの約定を記録するSQLiteファイル。
+STORE_DB = 'gnucash-import-stock.sqlite3'
+
+## 東京証券取引所の休業日の表。
+HOLIDAY_TXT = pathlib.Path(__file__).with_name('holiday.txt')
+
+# Date,Transaction ID,Number,Description,Notes,Commodity/Currency,Void Reason,Action,Memo,Full Account Name,Account Name,Amount With Sym,Amount Num.,Reconcile,Reconcile Date,Rate/Price
+# 2020-07-27,3dda6469c3e48ecb278255e842cde2bf,,買付,,CURRENCY::JPY,,Buy,,個人.資産:流動資産:有価証券:信用:岡三オンライン証券:株式:9973 小僧寿し,9973 小僧寿し,"20,000 9973",20000,c,,84
+# ,,,,,,,,手数料,個人.資産:流動資産:有価証券:信用:岡三オンライン証券:株式:9973 小僧寿し,9973 小僧寿し,0 9973,0,c,,0
+# ,,,,,,,,消費税,個人.資産:流動資産:有価証券:信用:岡三オンライン証券:株式:9973 小僧寿し,9973 小僧寿し,0 9973,0,c,,0
+# ,,,,,,,,,個人.負債:流動負債:未払金:有価証券:信用:岡三オンライン証券,岡三オンライン証券,"JP¥-1,680,543",-1680543,c,,1
+# 2020-07-27,0682292e8e103fd08cf4348208c5a154,,売付,,CURRENCY::JPY,,Sell,,個人.資産:流動資産:有価証券:信用:岡三オンライン証券:株式:9973 小僧寿し,9973 小僧寿し,"10,000 9973-",-10000,c,,84
+# ,,,,,,,,,個人.費用:営業外費用:その他:支払手数料:証券会社:岡三オンライン証券,岡三オンライン証券,JP¥256,256,c,,1
+# ,,,,,,,,消費税,個人.費用:営業外費用:その他:支払手数料:証券会社:岡三オンライン証券,岡三オンライン証券,JP¥25,25,c,,1
+# ,,,,,,,,,個人.費用:営業外費用:利子割引料:岡三オンライン証券,岡三オンライン証券,JP¥60,60,c,,1
+# ,,,,,,,,,個人.資産:流動資産:未収入金:有価証券:岡三オンライン証券,岡三オンライン証券,"JP¥839,659",839659,c,,1
+# ,,,,,,,,,個人.費用:営業外費用:有価証券売却損:岡三オンライン証券,岡三オンライン証券,"JP¥10,625",10625,c,,1
+# ,,,,,,,,売買損益,個人.資産:流動資産:有価証券:信用:岡三オンライン証券:株式:9973 小僧寿し,9973 小僧寿し,0 9973,0,c,,0
+# 2020-07-27,feae2c63c7815a9c68dca581bed0603e,,売付,,CURRENCY::JPY,,Sell,,個人.資産:流動資産:有価証券:信用:岡三オンライン証券:株式:9973 小僧寿し,9973 小僧寿し,"10,000 9973-",-10000,c,,86
+# ,,,,,,,,,個人.費用:営業外費用:その他:支払手数料:証券会社:岡三オンライン証券,岡三オンライン証券,JP¥254,254,c,,1
+# ,,,,,,,,消費税,個人.費用:営業外費用:その他:支払手数料:証券会社:岡三オンライン証券,岡三オンライン証券,JP¥21,21,c,,1
+# ,,,,,,,,,個人.費用:営業外費用:利子割引料:岡三オンライン証券,岡三オンライン証券,JP¥59,59,c,,1
+# ,,,,,,,,,個人.資産:流動資産:未収入金:有価証券:岡三オンライン証券,岡三オンライン証券,"JP¥859,666",859666,c,,1
+# ,,,,,,,,売買損益,個人.資産:流動資産:有価証券:信用:岡三オンライン証券:株式:9973 小僧寿し,9973 小僧寿し,0 9973,0,c,,0
+# ,,,,,,,,,個人.収益:営業外収益:分離課税:有価証券売却益:岡三オンライン証券,岡三オンライン証券,"JP¥-19,395",-19395,c,,1
+
+# GnuCashの取り込みで必須の列
+# - Commodity/Currency: これがないと通貨単位が変わる。
+# - Transaction ID: これがないと，複数の取引が同一取引とみなされまとめられる。
+# 有価証券の仕訳の場合，Amount Num.は必須のようだ。代わりに，Rate/Priceは0でも問題なかった。
+header = 'Date,Transaction ID,Number,Description,Notes,Commodity/Currency,Void Reason,Action,Memo,Full Account Name,Account Name,Amount With Sym,Amount Num.,Reconcile,Reconcile Date,Rate/Price'.split(',')
+ACCOUNT_COLUMN = header.index('Full Account Name')
+AMOUNT_COLUMN = header.index('Amount Num.')
+PRICE_COLUMN = header.index('Rate/Price')
+
+# BASE_ACCOUNT = '個人.資産:流動資産:有価証券:信用:岡三オンライン証券:株式:'
+# BASE_LIABILITY = '個人.負債:流動負債:未払金:有価証券:信用:岡三オンライン証券'
+BASE_ACCOUNT = '個人.資産:流動資産:有価証券:'
+BASE_LIABILITY = '個人.負債:流動負債:未払金:有価証券:'
+
+BASE_LOSS = '個人.費用:営業外費用:有価証券売却損:岡三オンライン証券'
+BASE_INCOME = '個人.収益:営業外収益:分離課税:有価証券売却益:岡三オンライン証券'
+BASE_FEE = '個人.費用:営業外費用:その他:支払手数料:証券会社:岡三オンライン証券'
+BASE_RATE = '個人.費用:営業外費用:利子割引料:岡三オンライン証券'
+BASE_ASSET = '個人.資産:流動資産:未収入金:有価証券'
+BASE_NATIONAL_TAX = '個人.費用:営業費用:販売費及び一般管理費:一般管理費:税金:国税:所得税:株式'
+BASE_LOCAL_TAX = '個人.費用:営業費用:販売費及び一般管理費:一般管理費:税金:地方税:道府県税:普通税:道府県民税:株式等譲渡所得割'
+BASE_BANK = '個人.資産:流動資産:その他:差入保証金:岡三オンライン証券'
+
+BASE_REAL_ACCOUNT = BASE_ACCOUNT + '現物:岡三オンライン証券:株式:'
+BASE_REAL_LIABILITY = BASE_LIABILITY + '現物:岡三オンライン証券'
+BASE_REAL_ASSET = BASE_ASSET + ':現物:岡三オンライン証券';
+BASE_CREDIT_ACCOUNT = BASE_ACCOUNT + '信用:岡三オンライン証券:株式:'
+BASE_CREDIT_BUY_ASSET = BASE_ASSET + ':信返売:岡三オンライン証券'
+BASE_CREDIT_BUY_LIABILITY = BASE_LIABILITY + '信新買:岡三オンライン証券'
+BASE_CREDIT_SELL_ASSET = BASE_ASSET + ':信新売:岡三オンライン証券'
+BASE_CREDIT_SELL_LIABILITY = BASE_LIABILITY + '信返買:岡三オンライン証券'
+
+## 勘定の設定ファイル。カレントディレクトリーにあれば既定の勘定の代わりに使う。
+ACCOUNTS_FILE = 'accounts.json'
+
+## 勘定の既定の設定。役割ごとの勘定名で，取引区分 (と精算) の辞書の値はその取引区分だけの設定。
+# 銘柄は銘柄の勘定の親勘定，精算は取引区分ごとの未収入金/未払金の勘定，
+# 銘柄勘定は銘柄の勘定名の書式 (銘柄コードと銘柄名を埋め込む)。
+DEFAULT_ACCOUNTS = {
+    '銘柄勘定': '{銘柄コード[0]}000:{銘柄コード} {銘柄名}',
+    '手数料': BASE_FEE,
+    '金利': BASE_RATE + ':金利',
+    '貸株料': BASE_RATE + ':貸株料',
+    '売却益': BASE_INCOME,
+    '売却損': BASE_LOSS,
+    '差入保証金': BASE_BANK,
+    '所得税': BASE_NATIONAL_TAX,
+    '地方税': BASE_LOCAL_TAX,
+    '現物買': {'銘柄': BASE_REAL_ACCOUNT, '精算': BASE_REAL_LIABILITY},
+    '現物売': {'銘柄': BASE_REAL_ACCOUNT, '精算': BASE_REAL_ASSET},
+    '信新買': {'銘柄': BASE_CREDIT_ACCOUNT, '精算': BASE_CREDIT_BUY_LIABILITY},
+    '信返売': {'銘柄': BASE_CREDIT_ACCOUNT, '精算': BASE_CREDIT_BUY_ASSET},
+    '信新売': {'銘柄': BASE_CREDIT_ACCOUNT, '精算': BASE_CREDIT_SELL_ASSET},
+    '信返買': {'銘柄': BASE_CREDIT_ACCOUNT, '精算': BASE_CREDIT_SELL_LIABILITY},
+    '精算': {},
+}
+
+
+TITLES = ('株式約定履歴', '信用決済履歴', '譲渡益税履歴')
+TITLE_BYTES = {title.encode('cp932'): title for title in TITLES}
+
+
+def sniff(path):
+    '''
+    ファイルの先頭SNIFF_BYTESバイトだけをバイナリーで読み，明細なら [タイトル, 検索開始日, 検索終了日] を返す。
+
+    タイトルはバイト列のまま比べるので，cp932で読めないファイルも単に明細でないとみなす。
+    検索期間は約定日などと比べられるように'YYYY/MM/DD'にし，読めなければ空文字列にする。
+    '''
+    with open(path, 'rb') as f:
+        lines = f.read(SNIFF_BYTES).splitlines()
+    title = TITLE_BYTES.get(lines[0]) if lines else None
+    if title is None: return None
+    period = re.findall(r'(\d+)年(\d+)月(\d+)日', lines[3].decode('cp932', 'replace')) \
+        if len(lines) > 3 else []
+    period = ['{}/{:0>2}/{:0>2}'.format(*date) for date in period[:2]]
+    return [title, *(period if len(period) == 2 else ['', ''])]
+
+
+def discover(directory='.', cache=DISCOVERY_CACHE, pattern='*.csv'):
+    '''
+    directoryのpatternに合う*.csvから明細を探し，タイトルごとの [(パス, 検索開始日, 検索終了日)] の辞書を返す。
+
+    各リストは検索期間とパスの順に並べる。識別結果はdirectoryのcacheに保存して，
+    サイズと更新時刻 (ナノ秒) が変わっていないファイルは次回から読まずに前回の結果を使う。
+    patternが全ての*.csvでなければ，合わないファイルの前回の結果も残す。
+    cacheは--batchで同じディレクトリーを並列に読んでも壊れないように，一時ファイルから置き換える。
+    '''
+    directory = pathlib.Path(directory)
+    try:
+        with open(directory/cache, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    found = {title: [] for title in TITLES}
+    new = {} if pattern == '*.csv' else dict(manifest)
+    for path in sorted(directory.glob(pattern)):
+        try:
+            stat = path.stat()
+            key = [stat.st_size, stat.st_mtime_ns]
+            entry = manifest.get(path.name)
+            result = entry[2] if entry and entry[:2] == key else sniff(path)
+        except OSError:
+            continue
+        new[path.name] = key + [result]
+        if result: found[result[0]].append((str(path), result[1], result[2]))
+
+    if new != manifest:
+        try:
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, \
+                    prefix=cache, delete=False) as f:
+                json.dump(new, f, ensure_ascii=False)
+            pathlib.Path(f.name).replace(directory/cache)
+        except OSError:
+            pass
+    for files in found.values():
+        files.sort(key=lambda file: (file[1], file[2], file[0]))
+    return found
+
+
+def pick_file(files):
+    '''
+    候補のファイルから1個を選ぶ。
+
+    検索終了日が最も新しく，その中で検索開始日が最も古い (期間が最も長い) ファイルを選び，
+    それでも決まらなければパスが最後のものを選ぶ。
+    '''
+    end = max(file[2] for file in files)
+    start = min(file[1] for file in files if file[2] == end)
+    return max(file for file in files if file[1:] == (start, end))
+
+
+def merge_periods(files):
+    '''
+    検索期間順の候補のファイルを全て結合するために，[(パス, 読み飛ばす最後の日)] を返す。
+
+    期間が重なる場合は前のファイルを優先し，後のファイルからは前のファイルの検索終了日より後の行だけを読む。
+    前のファイルの期間に全て含まれるファイルは除く。
+    '''
+    result = []
+    covered = ''
+    for path, start, end in files:
+        if result and end and end <= covered: continue
+        result.append((path, covered))
+        covered = max(covered, end)
+    return result
+
+
+class Statement:
+    '''
+    岡三オンライン証券の明細のCSVファイル。
+
+    冒頭をバイナリーでまとめて読み，signatureで始まる列名の行を探す。冒頭の検索条件の行数が変わっても読める。
+    列名の行より前はparse_preambleで冒頭の情報の辞書metaにする。
+    fileは列名の行から始まるテキストのファイルで，明細部分はPREAMBLE_BYTESずつ読んで順にデコードする。
+    '''
+    def __init__(self, path, signature):
+        self.path = path
+        binary = open(path, 'rb', buffering=PREAMBLE_BYTES)
+        head = binary.read(PREAMBLE_BYTES)
+        signature = signature.encode('cp932')
+        start = head.find(b'\n' + signature) + 1
+        if not start and not head.startswith(signature):
+            binary.close()
+            raise ConversionError('{} に列名の行 ({}) が見つからない'.format( \
+                path, signature.decode('cp932')))
+        binary.seek(start)
+        self.meta = parse_preamble(head[:start].decode('cp932'))
+        self.file = io.TextIOWrapper(binary, encoding='cp932', newline='')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+    def check(self, name, actual):
+        '''冒頭の情報nameの値が明細から集計したactualと違えば警告する。冒頭になければ何もしない。'''
+        if name in self.meta and int(self.meta[name]) != actual:
+            print('警告: {} の{} {} が明細の集計 {} と一致しない'.format( \
+                self.path, name, self.meta[name], actual), file=sys.stderr)
+
+
+def parse_preamble(text):
+    '''
+    明細の冒頭を {項目名: 値} の辞書にする。
+
+    冒頭は空行で区切った塊からなる。2行の塊は1行目が項目名，2行目が値のCSVで，
+    1行の塊はタイトルか「明細数：38件」のような項目名：値件。
+    '''
+    meta = {}
+    for filled, lines in itertools.groupby(text.splitlines(), key=bool):
+        lines = list(lines)
+        if not filled: continue
+        if len(lines) == 2:
+            meta.update(zip(*csv.reader(lines)))
+        elif len(lines) == 1:
+            match = re.fullmatch(r'(.+)：([+-]?\d+)件', lines[0])
+            if match: meta[match.group(1)] = match.group(2)
+            else: meta.setdefault('タイトル', lines[0])
+    return meta
+
+
+class Trade:
+    '''
+    株式約定履歴の1行。
+
+    計算に使う列は数値に変換して属性に持ち，元の行はlist.csvへの出力用にrawに持つ。
+    大量の約定を扱うので，辞書ではなく__slots__で属性を固定してメモリーと処理時間を減らす。
+    '''
+    __slots__ = ('raw', '約定日', '銘柄コード', '銘柄名', '取引区分', '約定数量', '約定単価', \
+        '手数料', '税額', '受渡日', '受渡金額', '決済代金', '貸株料', '金利', '決済損益', '売買代金', \
+        '新規建日', '新規建単価', '実現損益')
+
+    ## rawから取り出す列。手数料は手数料/諸経費等の列。
+    COLUMNS = ('約定日', '銘柄コード', '銘柄名', '取引区分', '約定数量', '約定単価', \
+        '手数料/諸経費等', '税額', '受渡日', '受渡金額')
+
+    def __init__(self, raw, index):
+        self.raw = raw
+        (self.約定日, self.銘柄コード, self.銘柄名, self.取引区分, quantity, self.約定単価, \
+            fee, tax, self.受渡日, self.受渡金額) = [raw[i] for i in index]
+        self.約定数量 = int(quantity)
+        self.手数料 = int(fee)
+        self.税額 = int(tax)
+        self.決済代金 = self.約定数量*float(self.約定単価)
+        self.貸株料 = 0
+        self.金利 = 0
+        self.決済損益 = 0
+        self.売買代金 = 0
+        self.新規建日 = ''
+        self.新規建単価 = ''
+        self.実現損益 = None
+
+
+## list.csvで株式約定履歴の列の後ろに追加する列。
+LIST_EXTRA = ['決済代金', '貸株料', '金利', '売買代金', '実現損益']
+
+
+## 各明細の列名の行の先頭。
+TRADE_SIGNATURE = '約定日,銘柄コード,'
+PAY_SIGNATURE = '取引区分,銘柄コード,'
+TAX_SIGNATURE = '銘柄コード,銘柄名,累投区分,'
+
+
+def read_trade(trade_file):
+    '''
+    株式約定履歴のStatementを読み込み，(列名, Tradeを1行ずつ返すジェネレーター) を返す。
+
+    読み終わったら冒頭の明細数と照合する。
+    '''
+    reader = csv.reader(trade_file.file)
+    header = next(reader)
+    index = [header.index(column) for column in Trade.COLUMNS]
+
+    def generate():
+        count = 0
+        for raw in reader:
+            if not raw: continue
+            count += 1
+            yield Trade(raw, index)
+        trade_file.check('明細数', count)
+    return header, generate()
+
+
+def read_trades(files):
+    '''
+    merge_periodsの [(パス, 読み飛ばす最後の日)] の株式約定履歴を順に読み，(列名, Tradeのジェネレーター) を返す。
+
+    約定日が読み飛ばす最後の日以前の行は読み飛ばす。ファイルは読む順に1個ずつ開く。
+    '''
+    with Statement(files[0][0], TRADE_SIGNATURE) as trade_file:
+        header, _ = read_trade(trade_file)
+
+    def generate():
+        for path, covered in files:
+            with Statement(path, TRADE_SIGNATURE) as trade_file:
+                _, trade = read_trade(trade_file)
+                if covered: trade = (row for row in trade if row.約定日 > covered)
+                yield from trade
+    return header, generate()
+
+
+def list_row(row, i_profit):
+    '''list.csvの1行を作る。i_profitは株式約定履歴の決済損益の列番号。'''
+    raw = list(row.raw)
+    raw[i_profit] = row.決済損益
+    raw += [row.決済代金, row.貸株料, row.金利, row.売買代金, row.実現損益]
+    return raw
+
+
+def read_pay(pay_file):
+    '''
+    信用決済履歴のStatementを読み込み，行を1件ずつdictで返す。
+
+    読み終わったら冒頭の明細数と決済損益合計と照合する。
+    '''
+    count = profit = 0
+    for row in csv.DictReader(pay_file.file):
+        count += 1
+        profit += int(row['決済損益'])
+        yield row
+    pay_file.check('明細数', count)
+    pay_file.check('決済損益合計', profit)
+
+
+def expect_total(totals, name, meta, skipped=0):
+    '''
+    明細の冒頭metaの合計nameから読み飛ばした分skippedを除いて，totals[name]に加える。
+
+    冒頭に合計がないファイルが1個でもあれば，totals[name]をNone (照合しない) にする。
+    '''
+    if totals.get(name, 0) is None or name not in meta:
+        totals[name] = None
+    else:
+        totals[name] = totals.get(name, 0) + int(meta[name]) - skipped
+
+
+def read_pays(files, totals=None):
+    '''
+    merge_periodsの [(パス, 読み飛ばす最後の日)] の信用決済履歴を順に読み，行を1件ずつ返す。
+
+    totalsを渡すと，読み飛ばさなかった決済の冒頭の決済損益合計をtotals['決済損益合計']に加える。
+    '''
+    for path, covered in files:
+        with Statement(path, PAY_SIGNATURE) as pay_file:
+            skipped = 0
+            for row in read_pay(pay_file):
+                if covered and row['決済日'] <= covered:
+                    skipped += int(row['決済損益'])
+                    continue
+                yield row
+            if totals is not None: expect_total(totals, '決済損益合計', pay_file.meta, skipped)
+
+
+def index_pay(reader):
+    '''
+    信用決済履歴を (銘柄コード, 決済日, 決済数量, 決済単価, 取引区分) をキーとした索引にする。
+
+    同じキーの決済が複数ある場合に備えて，値はファイル順の行のdequeにする (マルチマップ)。
+    戻り値は (索引, 金利・貸株料・決済損益が異なる行を含むキーの集合)。
+    '''
+    index = collections.defaultdict(collections.deque)
+    for row in reader:
+        key = (row['銘柄コード'], row['決済日'], int(row['決済数量']), row['決済単価'], row['取引区分'])
+        index[key].append(row)
+
+    ambiguous = {key for key, rows in index.items() if len(rows) > 1 and \
+        len({(row['貸株料'], row['金利'], row['決済損益']) for row in rows}) > 1}
+    return index, ambiguous
+
+
+def read_tax(tax_file):
+    '''
+    譲渡益税履歴のStatementを読み込み，(明細の索引, 受渡日ごとの譲渡益税) を返す。
+
+    明細の索引は現物の明細を (銘柄コード, 約定日, 数量) をキーとしたdequeの辞書にしたもの。
+    受渡日ごとの譲渡益税は受渡日をキーとした (所得税, 地方税) の辞書で，還付金は負数にする。
+    冒頭の譲渡益税徴収額合計・所得税・地方税，損益合計金額，明細数は明細の集計と照合して，違えば警告する。
+    '''
+    index = collections.defaultdict(collections.deque)
+    tax = {}
+    profit = count = 0
+    for row in csv.DictReader(tax_file.file):
+        ## 受渡日ごとの集計行: 銘柄コードの列に種類，商品の列に受渡日が入っている。
+        if row['銘柄コード'] in ('譲渡益税徴収額', '譲渡益税還付金'):
+            sign = 1 if row['銘柄コード'] == '譲渡益税徴収額' else -1
+            national, local = tax.get(row['商品'], (0, 0))
+            tax[row['商品']] = (
+                national + sign*(int(row['譲渡益税徴収額']) - int(row['地方税'])),
+                local + sign*int(row['地方税']))
+            continue
+
+        count += 1
+        profit += int(row['損益金額'])
+        if row['譲渡益税計算処理分類区分'].startswith('信用'): continue
+        index[(row['銘柄コード'], row['約定日'], int(row['数量']))].append(row)
+
+    national = sum(value[0] for value in tax.values())
+    local = sum(value[1] for value in tax.values())
+    tax_file.check('譲渡益税徴収額合計', national + local)
+    tax_file.check('所得税', national)
+    tax_file.check('地方税', local)
+    tax_file.check('損益合計金額', profit)
+    tax_file.check('明細数', count)
+    return index, tax
+
+
+def read_taxes(files, totals=None):
+    '''
+    merge_periodsの [(パス, 読み飛ばす最後の日)] の譲渡益税履歴を順に読み，read_taxと同じ戻り値にまとめる。
+
+    譲渡益税履歴の検索期間は受渡日なので，受渡日が読み飛ばす最後の日以前の明細と集計行は除く。
+    totalsを渡すと，除かなかった受渡日の冒頭の譲渡益税徴収額合計をtotals['譲渡益税徴収額合計']に加える。
+    '''
+    index, tax = collections.defaultdict(collections.deque), {}
+    for path, covered in files:
+        with Statement(path, TAX_SIGNATURE) as tax_file:
+            file_index, file_tax = read_tax(tax_file)
+        for key, rows in file_index.items():
+            index[key].extend(row for row in rows if row['受渡日'] > covered)
+        tax.update((date, value) for date, value in file_tax.items() if date > covered)
+        if totals is not None:
+            expect_total(totals, '譲渡益税徴収額合計', tax_file.meta, \
+                sum(sum(value) for date, value in file_tax.items() if date <= covered))
+    return index, tax
+
+
+def calc_trade(trade, index, ambiguous=frozenset(), report=None, tax_index=None):
+    '''
+    株式約定履歴に信用決済履歴の金利・貸株料と決済損益を取り込み，売買代金を計算する。
+
+    信返売/信返買はindex_payの索引から同じキーの決済を先頭から1件ずつ取り出して結合する。
+    現物売はtax_index (read_taxの明細の索引) があれば，同じように損益金額を決済損益に取り込む。
+    reportを渡すと，対応する決済がなかった約定を'unmatched'に，
+    候補の金額が一意でなかった約定を'ambiguous'に，
+    譲渡益税履歴に明細がなかった現物売を'untaxed'に追加する。
+    '''
+    # 受渡金額にすると，手数料の考慮が面倒くさいので，決済代金にする。
+    for row_trade in trade:
+        row_trade.売買代金 = int(row_trade.決済代金) + row_trade.手数料 + row_trade.税額
+        if row_trade.取引区分 == '信新売':
+            ## 売付では手数料と税額を受け取る代金から差し引く。
+            row_trade.売買代金 -= (row_trade.手数料 + row_trade.税額)*2
+        elif row_trade.取引区分 == '現物売':
+            row_trade.売買代金 = int(row_trade.受渡金額)
+            if tax_index is not None:
+                rows_tax = tax_index.get((row_trade.銘柄コード, row_trade.約定日, \
+                    row_trade.約定数量))
+                if rows_tax:
+                    row_trade.決済損益 = rows_tax.popleft()['損益金額']
+                elif report is not None:
+                    report['untaxed'].append(row_trade)
+        if not row_trade.取引区分.startswith('信返'):
+            yield row_trade
+            continue
+
+        key = (row_trade.銘柄コード, row_trade.約定日, row_trade.約定数量,
+            row_trade.約定単価, row_trade.取引区分)
+        rows_pay = index.get(key)
+        if not rows_pay:
+            if report is not None: report['unmatched'].append(row_trade)
+            row_pay = {'貸株料': 0, '金利': 0, '決済損益': 0, '新規建日': '', '新規建単価': ''}
+        else:
+            if key in ambiguous and report is not None:
+                report['ambiguous'].append(row_trade)
+            row_pay = rows_pay.popleft()
+
+        row_trade.貸株料 = int(row_pay['貸株料'])
+        row_trade.金利 = int(row_pay['金利'])
+        row_trade.決済損益 = row_pay['決済損益']
+        row_trade.新規建日 = row_pay['新規建日']
+        row_trade.新規建単価 = row_pay['新規建単価']
+        if row_trade.取引区分 == '信返売':
+            row_trade.売買代金 -= (row_trade.手数料 + row_trade.税額)*2 + row_trade.金利
+        else:
+            row_trade.売買代金 += row_trade.貸株料
+        yield row_trade
+
+
+def format_trade(row):
+    return '{} {} {} {}株 {}円'.format(row.約定日, row.銘柄コード, \
+        row.取引区分, row.約定数量, row.約定単価)
+
+
+def report_pay(index, report):
+    '''信用決済履歴との突き合わせ結果を標準エラー出力に表示する。'''
+    for row in report['unmatched']:
+        print('警告: 信用決済履歴に対応する決済がない:', format_trade(row), file=sys.stderr)
+    for row in report['ambiguous']:
+        print('警告: 信用決済履歴に金額の異なる同一条件の決済がある:', format_trade(row), file=sys.stderr)
+    for row in report['untaxed']:
+        print('警告: 譲渡益税履歴に対応する明細がない:', format_trade(row), file=sys.stderr)
+    if report.get('short'):
+        print('警告: 以前の約定がなく実現損益を計算できなかった売却・返済: {}件 (--incrementalで前回の在庫から続ける)'.format( \
+            len(report['short'])), file=sys.stderr)
+    for row in report['delivery']:
+        print('警告: 受渡日 {} が約定日の{}営業日後と一致しない:'.format(row.受渡日, \
+            settlement_days(row.約定日)), format_trade(row), file=sys.stderr)
+    for rows in index.values():
+        for row in rows:
+            print('警告: 株式約定履歴に対応する約定がない: {} {} {} {}株 {}円'.format( \
+                row['決済日'], row['銘柄コード'], row['取引区分'], row['決済数量'], \
+                row['決済単価']), file=sys.stderr)
+
+
+trade_key = operator.attrgetter('約定日', '取引区分', '銘柄コード', '決済代金')
+
+
+def _load_run(run):
+    while True:
+        try:
+            yield pickle.load(run)
+        except EOFError:
+            return
+
+
+def sort_trade(trade, chunk_rows=SORT_CHUNK_ROWS):
+    '''
+    約定日・取引区分・銘柄コード・決済代金の順番に並べて1行ずつ返す。
+
+    chunk_rows行ごとに整列して一時ファイルに書き出し，heapq.mergeでマージする外部ソート。
+    全体がchunk_rows行に収まる場合は一時ファイルを使わない。
+    heapq.mergeは同じキーなら先のrunを優先するので，sortedと同じ安定ソートになる。
+    '''
+    runs = []
+    try:
+        while True:
+            chunk = sorted(itertools.islice(trade, chunk_rows), key=trade_key)
+            if not chunk: break
+            if not runs and len(chunk) < chunk_rows:
+                yield from chunk
+                return
+
+            run = tempfile.TemporaryFile()
+            for dic in chunk:
+                pickle.dump(dic, run, pickle.HIGHEST_PROTOCOL)
+            run.seek(0)
+            runs.append(run)
+            del chunk
+
+        yield from heapq.merge(*map(_load_run, runs), key=trade_key)
+    finally:
+        for run in runs:
+            run.close()
+
+
+## Transaction IDの元にする株式約定履歴の列。
+# 同じ日に同じ内容の約定が複数ある場合は，出現順の番号も加えて区別する。
+TID_FIELDS = ['約定日', '銘柄コード', '取引区分', '約定数量', '約定単価', \
+    '手数料', '税額', '受渡日']
+tid_fields = operator.attrgetter(*TID_FIELDS)
+
+
+def make_tid(*fields):
+    '''識別用の値から32桁のTransaction IDを作る。同じ値からは常に同じIDになる。'''
+    return hashlib.md5('\x1f'.join(map(str, fields)).encode()).hexdigest() # 32桁
+
+
+def tid_trade(trade, salt=()):
+    '''
+    ソート済みの約定に (Transaction ID, 行) の組を付けて返す。
+
+    同じ内容の約定はソート後に同じtrade_keyの並びに集まるので，
+    出現順の番号はtrade_keyが変わるたびに数え直す。
+    salt (値のタプル) を渡すと，それもIDの元に加える (--batchでジョブごとにIDを分ける)。
+    '''
+    group = None
+    count = {}
+    for row in trade:
+        if trade_key(row) != group:
+            group = trade_key(row)
+            count.clear()
+        fields = tid_fields(row)
+        count[fields] = count.get(fields, 0) + 1
+        yield make_tid(*salt, *fields, count[fields]), row
+
+
+def open_store(path):
+    '''変換済みの約定のTransaction IDと，譲渡益税を精算に入れた精算日を記録するSQLiteファイルを開く。'''
+    con = sqlite3.connect(path)
+    con.execute('CREATE TABLE IF NOT EXISTS trade (tid TEXT PRIMARY KEY, date TEXT)')
+    con.execute('CREATE TABLE IF NOT EXISTS tax (date TEXT PRIMARY KEY)')
+    con.execute('CREATE TABLE IF NOT EXISTS lot (kind TEXT, code TEXT, name TEXT, date TEXT, '
+        'quantity INTEGER, price TEXT, amount INTEGER)')
+    return con
+
+
+def skip_stored(trade, con, new):
+    '''conに記録済みの約定を読み飛ばし，未変換の約定だけを返す。未変換の約定のIDはnewに追加する。'''
+    for tid, row in trade:
+        if con.execute('SELECT 1 FROM trade WHERE tid = ?', (tid,)).fetchone(): continue
+        new.append((tid, row.約定日))
+        yield tid, row
+
+
+## 取引区分ごとの (ロットの種類, 新規か)。
+LOT_KINDS = {'現物買': ('現物', True), '現物売': ('現物', False), \
+    '信新買': ('買建', True), '信返売': ('買建', False), \
+    '信新売': ('売建', True), '信返買': ('売建', False)}
+
+## position.csvの列。
+POSITION_HEADER = ['種類', '銘柄コード', '銘柄名', '約定日', '数量', '単価', '金額']
+
+
+class Lots:
+    '''
+    銘柄コードごとの現物と建玉の在庫 (ロット)。
+
+    ロットは [約定日, 数量, 単価, 金額] のリストで，金額は現物と買建では手数料込みの取得金額，
+    売建では手数料を引いた売却金額。(種類, 銘柄コード) ごとのdequeに約定順に並べ，
+    売却と返済では古いものから消化する (先入先出)。信用決済履歴と結び付いた信返売/信返買は，
+    新規建日と新規建単価が一致するロットだけを消化する (建玉の指定)。
+    一部だけ消化したロットは金額を数量で按分して残す。
+
+    建玉の指定で引けるように，建玉のロットは (約定日, 単価の数値) をキーとした索引のdequeにも並べる。
+    単価は開いたときに1回だけ数値にする。消化し切ったロットは数量を0にし，どちらのdequeからも
+    先頭に来たときに取り除くので，1件の売却・返済の手間は消化したロットの数に比例する。
+    '''
+    def __init__(self):
+        self.lots = collections.defaultdict(collections.deque)
+        ## (種類, 銘柄コード) → {(約定日, 単価の数値): 約定順のロットのdeque}
+        self.index = collections.defaultdict(lambda: collections.defaultdict(collections.deque))
+        self.names = {}
+        self.realized = 0
+
+    def add(self, key, lot):
+        '''ロットlotを (種類, 銘柄コード) keyの在庫の末尾に加える。'''
+        self.lots[key].append(lot)
+        ## 現物は常に先入先出なので索引に入れない。
+        if key[0] != '現物': self.index[key][(lot[0], float(lot[2]))].append(lot)
+
+    def open(self, row):
+        kind = LOT_KINDS[row.取引区分][0]
+        fee = row.手数料 + row.税額
+        amount = int(row.決済代金) + (-fee if kind == '売建' else fee)
+        self.add((kind, row.銘柄コード), [row.約定日, row.約定数量, row.約定単価, amount])
+        self.names[row.銘柄コード] = row.銘柄名
+
+    def take(self, lots, quantity):
+        '''
+        ロットのdeque lotsの先頭からquantityまでを消化し，(残りの数量, 消化した金額) を返す。
+
+        消化し切ったロット (もう一方のdequeで消化したものを含む) は先頭から取り除く。
+        '''
+        basis = 0
+        while lots and (quantity or not lots[0][1]):
+            lot = lots[0]
+            held, amount = lot[1], lot[3]
+            if quantity >= held:
+                lot[1] = lot[3] = 0
+                lots.popleft()
+                quantity -= held
+                basis += amount
+            else:
+                part = round(amount*quantity/held)
+                lot[1] -= quantity
+                lot[3] -= part
+                quantity = 0
+                basis += part
+        return quantity, basis
+
+    def close(self, row):
+        '''
+        売却か返済を処理して実現損益を返す。ロットが足りなければ，あるだけ消化してNoneを返す。
+
+        実現損益は売却・返済の金額 (手数料・金利・貸株料を含む) と消化したロットの金額の差。
+        '''
+        kind = LOT_KINDS[row.取引区分][0]
+        key = (kind, row.銘柄コード)
+        if row.新規建日 and kind != '現物':
+            index = self.index[key]
+            spec = (row.新規建日, float(row.新規建単価))
+            quantity, basis = self.take(index[spec], row.約定数量)
+            if not index[spec]: del index[spec]
+            ## 在庫の先頭の消化し切ったロットを取り除く。
+            self.take(self.lots[key], 0)
+        else:
+            quantity, basis = self.take(self.lots[key], row.約定数量)
+        if not self.lots[key]:
+            del self.lots[key]
+            self.index.pop(key, None)
+        if quantity: return None
+
+        cost = row.手数料 + row.税額 + row.金利 + row.貸株料
+        if kind == '売建':
+            realized = basis - (int(row.決済代金) + cost)
+        else:
+            realized = int(row.決済代金) - cost - basis
+        self.realized += realized
+        return realized
+
+    def rows(self):
+        '''position.csvの行を (種類, 銘柄コード, 約定日) の順に返す。'''
+        for (kind, code), lots in sorted(self.lots.items()):
+            for date, quantity, price, amount in lots:
+                if quantity: yield [kind, code, self.names.get(code, ''), date, quantity, price, amount]
+
+    def load(self, con):
+        '''open_storeのスナップショットから在庫を読み込む。'''
+        for kind, code, name, date, quantity, price, amount in con.execute( \
+                'SELECT kind, code, name, date, quantity, price, amount FROM lot ORDER BY rowid'):
+            self.add((kind, code), [date, quantity, price, amount])
+            self.names[code] = name
+
+    def save(self, con):
+        '''在庫をスナップショットとしてconに書き込む。コミットは呼び出し側で行う。'''
+        con.execute('DELETE FROM lot')
+        con.executemany('INSERT INTO lot (kind, code, name, date, quantity, price, amount) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)', self.rows())
+
+
+def track_lots(trade, lots, report=None):
+    '''
+    tid_tradeの (Transaction ID, Trade) をlotsに通して実現損益を実現損益の属性に入れる。
+
+    同じ日の買付の前に売却が並ぶこともあるので，約定日ごとにまとめて新規を先に処理する。
+    譲渡益税履歴に損益がなかった現物売は，計算した実現損益を決済損益にする。
+    reportを渡すと，ロットが足りずに実現損益を計算できなかった約定を'short'に追加する。
+    '''
+    for date, group in itertools.groupby(trade, key=lambda item: item[1].約定日):
+        group = list(group)
+        for tid, row in group:
+            if LOT_KINDS.get(row.取引区分, (None, False))[1]: lots.open(row)
+        for tid, row in group:
+            if LOT_KINDS.get(row.取引区分, (None, True))[1]: continue
+            row.実現損益 = lots.close(row)
+            if row.実現損益 is None:
+                if report is not None: report['short'].append(row)
+            elif row.取引区分 == '現物売' and row.決済損益 == 0:
+                row.決済損益 = '{:+d}'.format(row.実現損益)
+        yield from group
+
+
+def compile_template(fields, rows, accounts=None, kind=None):
+    '''
+    分割のテンプレートをcsv.writerにそのまま渡せる行を作る関数のリストに変換する。
+
+    テンプレートの各行はheaderの列名をキーとした辞書で，値が'{名前}'の項目はfieldsの名前の
+    位置に渡される約定ごとの値に，それ以外は定数に置き換える。Reconcileは常に'c'にする。
+    '[役割]'と'[取引区分:役割]'の値は，accounts ((取引区分, 役割) をキーとした勘定名の表) の
+    (kind, 役割) と (取引区分, 役割) の勘定名の定数にする。
+    戻り値は (定数のタプル, operator.itemgetterのリスト) で，
+    itemgetterには約定ごとの値のタプルに定数のタプルを連結したものを渡す。
+    '''
+    const = []
+    getters = []
+    for template in rows:
+        template = dict(template, Reconcile='c')
+        index = []
+        for column in header:
+            value = template.get(column, '')
+            if isinstance(value, str) and value.startswith('{') and value.endswith('}'):
+                index.append(fields.index(value[1:-1]))
+                continue
+            if isinstance(value, str) and value.startswith('[') and value.endswith(']'):
+                key = value[1:-1].split(':', 1)
+                value = accounts[tuple(key) if len(key) == 2 else (kind, key[0])]
+            index.append(len(fields) + len(const))
+            const.append(value)
+        getters.append(operator.itemgetter(*index))
+    return tuple(const), getters
+
+
+## 約定ごとに値が変わる分割の項目。Accounts.make_splitはこの順番で値を渡す。
+SPLIT_FIELDS = ['約定日', 'Transaction ID', '銘柄勘定', '約定数量', '-約定数量', '約定単価', \
+    '手数料', '税額', '金利', '貸株料', '売買代金', '-売買代金', '決済損益', '-決済損益', '損益勘定']
+
+## 取引区分ごとの分割のテンプレート。勘定はAccountsで設定の勘定名に置き換えてコンパイルする。
+SPLIT_TEMPLATE = {
+    '現物売': [
+        # 1行目: 約定
+        {'Date': '{約定日}', 'Transaction ID': '{Transaction ID}', 'Description': '売付', \
+         'Commodity/Currency': 'CURRENCY::JPY', 'Full Account Name': '{銘柄勘定}', \
+         'Amount Num.': '{-約定数量}', 'Rate/Price': '{約定単価}'},
+        # 2行目: 手数料
+        {'Full Account Name': '[手数料]', 'Amount Num.': '{手数料}', 'Rate/Price': 1},
+        # 3行目: 消費税
+        {'Memo': '消費税', 'Full Account Name': '[手数料]', 'Amount Num.': '{税額}', 'Rate/Price': 1},
+        # 4行目: 売買代金
+        {'Full Account Name': '[精算]', 'Amount Num.': '{売買代金}', 'Rate/Price': 1},
+        # 5行目: 売買損益
+        {'Memo': '売買損益', 'Full Account Name': '{銘柄勘定}', 'Amount Num.': '{決済損益}', \
+         'Rate/Price': 1},
+        # 6行目: 損益
+        {'Full Account Name': '[売却益]', 'Amount Num.': '{-決済損益}', 'Rate/Price': 1},
+    ],
+}
+
+for kind, amount, cash in [
+        ('現物買', '{約定数量}', '{-売買代金}'),
+        ('信新買', '{約定数量}', '{-売買代金}'),
+        ('信新売', '{-約定数量}', '{売買代金}')]:
+    SPLIT_TEMPLATE[kind] = [
+        # 1行目
+        {'Date': '{約定日}', 'Transaction ID': '{Transaction ID}', 'Description': kind, \
+         'Commodity/Currency': 'CURRENCY::JPY', 'Full Account Name': '{銘柄勘定}', \
+         'Amount Num.': amount, 'Rate/Price': '{約定単価}'},
+        # 2行目
+        {'Memo': '手数料', 'Full Account Name': '{銘柄勘定}', 'Amount Num.': '{手数料}', \
+         'Rate/Price': 1},
+        # 3行目
+        {'Memo': '消費税', 'Full Account Name': '{銘柄勘定}', 'Amount Num.': '{税額}', \
+         'Rate/Price': 1},
+        # 4行目
+        {'Full Account Name': '[精算]', 'Amount Num.': cash, 'Rate/Price': 1},
+    ]
+
+for kind, amount, rate, cost, cash in [
+        ('信返売', '{-約定数量}', '[金利]', '{金利}', '{売買代金}'),
+        ('信返買', '{約定数量}', '[貸株料]', '{貸株料}', '{-売買代金}')]:
+    SPLIT_TEMPLATE[kind] = [
+        # 1行目
+        {'Date': '{約定日}', 'Transaction ID': '{Transaction ID}', 'Description': kind, \
+         'Commodity/Currency': 'CURRENCY::JPY', 'Full Account Name': '{銘柄勘定}', \
+         'Amount Num.': amount, 'Rate/Price': '{約定単価}'},
+        # 2行目
+        {'Full Account Name': '[手数料]', 'Amount Num.': '{手数料}', 'Rate/Price': 1},
+        # 3行目
+        {'Memo': '消費税', 'Full Account Name': '[手数料]', 'Amount Num.': '{税額}', 'Rate/Price': 1},
+        # 4行目
+        {'Full Account Name': rate, 'Amount Num.': cost, 'Rate/Price': 1},
+        # 5行目
+        {'Full Account Name': '[精算]', 'Amount Num.': cash, 'Rate/Price': 1},
+        # 6行目
+        {'Memo': '売買損益', 'Full Account Name': '{銘柄勘定}', 'Amount Num.': '{決済損益}', \
+         'Rate/Price': 1},
+        # 7行目
+        {'Full Account Name': '{損益勘定}', 'Amount Num.': '{-決済損益}', 'Rate/Price': 1},
+    ]
+
+
+## 精算の分割で値が変わる項目。
+SETTLEMENT_FIELDS = ['精算日', 'Transaction ID', '精算金額', '所得税', '地方税', \
+    '現物買', '-現物売', '信新買', '-信返売', '-信新売', '信返買']
+
+SETTLEMENT_TEMPLATE = [
+    # 1行目
+    {'Date': '{精算日}', 'Transaction ID': '{Transaction ID}', 'Description': '精算', \
+     'Commodity/Currency': 'CURRENCY::JPY', 'Full Account Name': '[差入保証金]', \
+     'Amount Num.': '{精算金額}', 'Rate/Price': 1},
+    # 2行目: 譲渡益税徴収額 (所得税)
+    {'Memo': '譲渡益税徴収額', 'Full Account Name': '[所得税]', \
+     'Amount Num.': '{所得税}', 'Rate/Price': 1},
+    # 3行目: 譲渡益税徴収額 (地方税)
+    {'Memo': '譲渡益税徴収額', 'Full Account Name': '[地方税]', \
+     'Amount Num.': '{地方税}', 'Rate/Price': 1},
+    # 4行目: 現物買
+    {'Memo': '現物買', 'Full Account Name': '[現物買:精算]', \
+     'Amount Num.': '{現物買}', 'Rate/Price': 1},
+    # 5行目: 現物売
+    {'Memo': '現物売', 'Full Account Name': '[現物売:精算]', \
+     'Amount Num.': '{-現物売}', 'Rate/Price': 1},
+    # 6行目: 信新買
+    {'Memo': '信新買', 'Full Account Name': '[信新買:精算]', \
+     'Amount Num.': '{信新買}', 'Rate/Price': 1},
+    # 7行目: 信用売
+    {'Memo': '信返売', 'Full Account Name': '[信返売:精算]', \
+     'Amount Num.': '{-信返売}', 'Rate/Price': 1},
+    # 8行目: 信新売
+    {'Memo': '信新売', 'Full Account Name': '[信新売:精算]', \
+     'Amount Num.': '{-信新売}', 'Rate/Price': 1},
+    # 9行目: 信返買
+    {'Memo': '信返買', 'Full Account Name': '[信返買:精算]', \
+     'Amount Num.': '{信返買}', 'Rate/Price': 1},
+]
+
+
+## 精算で集計する取引区分。
+SETTLEMENT_KINDS = ['現物買', '現物売', '信新買', '信返売', '信新売', '信返買']
+
+
+class Calendar:
+    '''
+    東京証券取引所の営業日カレンダー。
+
+    休業日の表 (holiday.txt) の年の範囲の営業日を序数 (date.toordinal) の昇順のリストに展開し，
+    N営業日後をbisectで引く。結果は日付ごとに覚えておくので，同じ日付の約定が続いても速い。
+    表の範囲外の日付は土日だけを休業日とみなす。
+    '''
+    def __init__(self, path=HOLIDAY_TXT):
+        holidays = set()
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if not line: continue
+                date = datetime.datetime.strptime(line.split(',')[0], '%Y/%m/%d').date()
+                holidays.add(date.toordinal())
+
+        years = [datetime.date.fromordinal(day).year for day in holidays]
+        self.first = datetime.date(min(years), 1, 1).toordinal()
+        self.last = datetime.date(max(years), 12, 31).toordinal()
+        self.days = [day for day in range(self.first, self.last + 1) \
+            if day not in holidays and datetime.date.fromordinal(day).weekday() < 5]
+        self.cache = {}
+        self.warned = False
+
+    def after(self, date, n):
+        '''date (YYYY/MM/DD) のn営業日後の日付を同じ書式で返す。'''
+        key = (date, n)
+        if key in self.cache: return self.cache[key]
+
+        day = datetime.datetime.strptime(date, '%Y/%m/%d').date().toordinal()
+        i = bisect.bisect_right(self.days, day) + n - 1
+        if self.first <= day and i < len(self.days):
+            day = self.days[i]
+        else:
+            if not self.warned:
+                print('警告: 休業日の表 {} の範囲外の日付 {} は土日だけを休業日とみなす'.format( \
+                    HOLIDAY_TXT.name, date), file=sys.stderr)
+                self.warned = True
+            while n > 0:
+                day += 1
+                if datetime.date.fromordinal(day).weekday() < 5: n -= 1
+
+        self.cache[key] = datetime.date.fromordinal(day).strftime('%Y/%m/%d')
+        return self.cache[key]
+
+
+## 受渡日までの営業日数。2019/07/16約定分からT+2，それより前はT+3。
+def settlement_days(date):
+    return 2 if date >= '2019/07/16' else 3
+
+
+def settle_date(row, calendar, report=None):
+    '''
+    約定の精算日を返す。
+
+    受渡日がない信新買/信新売はcalendarで約定日の受渡日までの営業日後にする。
+    受渡日があればそれを使い，営業日から求めた日と違えばreportの'delivery'に追加する。
+    '''
+    pay_date = calendar.after(row.約定日, settlement_days(row.約定日))
+    if not row.受渡日: return pay_date
+    if row.受渡日 != pay_date and report is not None:
+        report['delivery'].append(row)
+    return row.受渡日
+
+
+class Accounts:
+    '''
+    勘定の設定をコンパイルした表と，それを使って分割の行を作る処理。
+
+    設定 (DEFAULT_ACCOUNTSと同じ形の辞書) を既定の設定に重ね，(取引区分, 役割) をキーとした
+    勘定名の表tableを作る。分割のテンプレートの勘定はこの表の勘定名の定数にしてコンパイルしておき，
+    約定ごとには組み立てない。銘柄の勘定名は (取引区分, 銘柄コード, 銘柄名) ごとに1回だけ作って
+    stocksにキャッシュする。
+
+    設定は作るときに全て確かめ，使われない項目，文字列でない勘定名，取引区分の辞書でない値，
+    銘柄コードと銘柄名を埋め込めない銘柄勘定の書式があれば，全ての問題を並べてValueErrorを送出する。
+    '''
+    def __init__(self, config=None):
+        merged = {key: dict(value) if isinstance(value, dict) else value \
+            for key, value in DEFAULT_ACCOUNTS.items()}
+        roles = {key for key, value in DEFAULT_ACCOUNTS.items() if not isinstance(value, dict)} \
+            | {'銘柄', '精算'}
+        errors = []
+        if not isinstance(config or {}, dict):
+            raise ValueError('勘定の設定が辞書でない')
+        for key, value in (config or {}).items():
+            if key not in merged:
+                errors.append('{}は使われない'.format(key))
+            elif isinstance(merged[key], dict):
+                if not isinstance(value, dict):
+                    errors.append('{}が辞書でない'.format(key))
+                    continue
+                for role, account in value.items():
+                    if role not in roles:
+                        errors.append('{}の{}は使われない'.format(key, role))
+                    elif not isinstance(account, str):
+                        errors.append('{}の{}が文字列でない'.format(key, role))
+                    else:
+                        merged[key][role] = account
+            elif not isinstance(value, str):
+                errors.append('{}が文字列でない'.format(key))
+            else:
+                merged[key] = value
+
+        self.table = {}
+        for kind in SETTLEMENT_KINDS + ['精算']:
+            for role, value in merged.items():
+                if not isinstance(value, dict): self.table[(kind, role)] = value
+            for role, value in merged[kind].items():
+                self.table[(kind, role)] = value
+        for form in dict.fromkeys(self.table[(kind, '銘柄勘定')] for kind in SPLIT_TEMPLATE):
+            try:
+                form.format(銘柄コード='1234', 銘柄名='銘柄')
+            except (KeyError, IndexError, ValueError, AttributeError) as error:
+                errors.append('銘柄勘定 {} に銘柄コードと銘柄名を埋め込めない: {!r}'.format(form, error))
+        if errors:
+            raise ValueError('，'.join(dict.fromkeys(errors)))
+
+        self.split_template = {kind: compile_template(SPLIT_FIELDS, rows, self.table, kind) \
+            for kind, rows in SPLIT_TEMPLATE.items()}
+        self.settlement_template = compile_template(SETTLEMENT_FIELDS, SETTLEMENT_TEMPLATE, \
+            self.table, '精算')
+        self.stock_parents = tuple(sorted({self.table[(kind, '銘柄')] for kind in SPLIT_TEMPLATE}))
+        self.stocks = {}
+
+    def stock(self, kind, code, name):
+        '''取引区分kindの銘柄の勘定名を返す。'''
+        key = (kind, code, name)
+        account = self.stocks.get(key)
+        if account is None:
+            account = sys.intern(self.table[(kind, '銘柄')] + \
+                self.table[(kind, '銘柄勘定')].format(銘柄コード=code, 銘柄名=name))
+            self.stocks[key] = account
+        return account
+
+    def make_split(self, row, tid):
+        '''株式約定履歴の1行をGnuCashへの取り込み用の分割 (split) の行のリストに整形して返す。'''
+        template = self.split_template.get(row.取引区分)
+        if template is None: return []
+
+        const, getters = template
+        profit = int(row.決済損益)
+        values = (row.約定日, tid, self.stock(row.取引区分, row.銘柄コード, row.銘柄名), \
+            row.約定数量, -row.約定数量, row.約定単価, row.手数料, row.税額, row.金利, row.貸株料, \
+            row.売買代金, -row.売買代金, row.決済損益, -profit, \
+            self.table[(row.取引区分, '売却益' if profit > 0 else '売却損')]) + const
+        return [getter(values) for getter in getters]
+
+    def make_settlement(self, pay_date, total, tax=None, context=()):
+        '''
+        精算日pay_dateの取引区分ごとの売買代金の合計 (total) から精算の分割の行のリストを作る。
+
+        tax (read_taxの受渡日ごとの譲渡益税) に精算日の譲渡益税があれば，
+        所得税と地方税の分割に金額を入れて，その分を差入保証金から差し引く。
+        Transaction IDは精算日とcontext (分割ファイルのキーなど，同じ精算日の精算を区別する値) から作り，
+        合計には依らないので，明細が増えて合計が変わっても同じ精算のIDのままになる。
+        '''
+        national, local = (tax or {}).get(pay_date, (None, None))
+        amount = total['現物売'] - total['現物買'] \
+            + total['信返売'] - total['信新買'] \
+            + total['信新売'] - total['信返買']
+        if national is not None:
+            amount -= national + local
+
+        const, getters = self.settlement_template
+        values = (pay_date, make_tid('精算', pay_date, *context), amount, national, local, \
+            total['現物買'], -total['現物売'], total['信新買'], -total['信返売'], \
+            -total['信新売'], total['信返買']) + const
+        return [getter(values) for getter in getters]
+
+
+def load_accounts(path):
+    '''勘定の設定ファイル (JSONか，Python 3.11以降ならTOML) を読み込んでAccountsを返す。'''
+    path = pathlib.Path(path)
+    ## tomllibはTOMLを読むときだけimportする。
+    loader = json
+    if path.suffix == '.toml':
+        try:
+            import tomllib as loader
+        except ImportError:
+            raise ConversionError('TOMLの勘定の設定 {} の読み込みにはPython 3.11以降が必要'.format(path))
+    try:
+        with path.open('rb') as f:
+            config = loader.load(f)
+    except (OSError, ValueError) as error:
+        raise ConversionError('勘定の設定 {} を読み込めない: {}'.format(path, error))
+    try:
+        return Accounts(config)
+    except ValueError as error:
+        raise ConversionError('勘定の設定 {} が正しくない: {}'.format(path, error))
+
+
+## 既定の勘定の設定の表。
+ACCOUNTS = Accounts()
+
+
+class Balance:
+    '''
+    書き込む前の取引の分割の行が釣り合っていることを，仕訳の作成と同じ1回の処理の中で確かめる。
+
+    checkは取引ごとに分割の金額 (値段が1でない約定の行は数量×値段) を合計し，1円以上ずれていれば
+    元の約定か精算日を表示するConversionErrorで中断する。同時に信返売/信返買の損益の勘定と精算の
+    所得税・地方税の勘定の金額を集計し，finishで明細の冒頭の決済損益合計と譲渡益税徴収額合計と照合する。
+    '''
+    def __init__(self, accounts):
+        self.profit_accounts = frozenset(accounts.table[(kind, role)] \
+            for kind in ('信返売', '信返買') for role in ('売却益', '売却損'))
+        self.tax_accounts = frozenset((accounts.table[('精算', '所得税')], \
+            accounts.table[('精算', '地方税')]))
+        self.profit = 0
+        self.tax = 0
+
+    def check(self, rows, source):
+        '''取引の分割の行rowsの釣り合いを確かめる。sourceは元の約定 (Trade) か精算日。'''
+        trade = isinstance(source, Trade)
+        credit = trade and source.取引区分.startswith('信返')
+        total = 0
+        for split in rows:
+            amount = float(split[AMOUNT_COLUMN] or 0)
+            price = split[PRICE_COLUMN]
+            value = amount if price == 1 else amount*float(price)
+            total += value
+            if credit:
+                if split[ACCOUNT_COLUMN] in self.profit_accounts: self.profit -= value
+            elif not trade and split[ACCOUNT_COLUMN] in self.tax_accounts:
+                self.tax += value
+        if abs(total) >= 1:
+            raise ConversionError('仕訳が{:+.0f}円釣り合わない: {}'.format(total, \
+                '{} ({})'.format(format_trade(source), ','.join(source.raw)) if trade \
+                else '{}の精算'.format(source)))
+
+    def finish(self, profit=None, tax=None):
+        '''集計した決済損益と譲渡益税を期待値profitとtax (Noneなら照合しない) と照合する。'''
+        for name, actual, expected in (('決済損益合計', self.profit, profit), \
+                ('譲渡益税徴収額合計', self.tax, tax)):
+            if expected is not None and round(actual) != expected:
+                raise ConversionError('仕訳の{} {} が明細の冒頭の {} と一致しない'.format( \
+                    name, round(actual), expected))
+
+
+## GnuCashのSQLiteの帳簿の最小限のテーブル。create_bookで動作確認用の空の帳簿を作るのに使う。
+BOOK_SCHEMA = '''
+CREATE TABLE gnclock (hostname varchar(255), pid int);
+CREATE TABLE versions (table_name text(50) PRIMARY KEY NOT NULL, table_version integer NOT NULL);
+CREATE TABLE books (guid text(32) PRIMARY KEY NOT NULL, root_account_guid text(32) NOT NULL,
+    root_template_guid text(32) NOT NULL);
+CREATE TABLE commodities (guid text(32) PRIMARY KEY NOT NULL, namespace text(2048) NOT NULL,
+    mnemonic text(2048) NOT NULL, fullname text(2048), cusip text(2048), fraction integer NOT NULL,
+    quote_flag integer NOT NULL, quote_source text(2048), quote_tz text(2048));
+CREATE TABLE accounts (guid text(32) PRIMARY KEY NOT NULL, name text(2048) NOT NULL,
+    account_type text(2048) NOT NULL, commodity_guid text(32), commodity_scu integer NOT NULL,
+    non_std_scu integer NOT NULL, parent_guid text(32), code text(2048), description text(2048),
+    hidden integer, placeholder integer);
+CREATE TABLE transactions (guid text(32) PRIMARY KEY NOT NULL, currency_guid text(32) NOT NULL,
+    num text(2048) NOT NULL, post_date text(19), enter_date text(19), description text(2048));
+CREATE INDEX tx_post_date_index ON transactions (post_date);
+CREATE TABLE splits (guid text(32) PRIMARY KEY NOT NULL, tx_guid text(32) NOT NULL,
+    account_guid text(32) NOT NULL, memo text(2048) NOT NULL, action text(2048) NOT NULL,
+    reconcile_state text(1) NOT NULL, reconcile_date text(19), value_num bigint NOT NULL,
+    value_denom bigint NOT NULL, quantity_num bigint NOT NULL, quantity_denom bigint NOT NULL,
+    lot_guid text(32));
+CREATE INDEX splits_tx_guid_index ON splits (tx_guid);
+CREATE INDEX splits_account_guid_index ON splits (account_guid);
+CREATE TABLE slots (id integer PRIMARY KEY AUTOINCREMENT NOT NULL, obj_guid text(32) NOT NULL,
+    name text(4096) NOT NULL, slot_type integer NOT NULL, int64_val bigint, string_val text(4096),
+    double_val float8, timespec_val text(19), guid_val text(32), numeric_val_num bigint,
+    numeric_val_denom bigint, gdate_val text(8));
+CREATE INDEX slots_guid_index ON slots (obj_guid);
+'''
+
+
+def create_book(path):
+    '''
+    ルート勘定と日本円だけの空のGnuCashのSQLiteの帳簿をpathに作る。
+
+    BookWriterの動作確認用。GnuCashで使う帳簿はGnuCashで作成する。
+    '''
+    con = sqlite3.connect(path)
+    with con:
+        con.executescript(BOOK_SCHEMA)
+        con.executemany('INSERT INTO versions VALUES (?, ?)', [('accounts', 1), \
+            ('books', 1), ('commodities', 1), ('slots', 4), ('splits', 4), ('transactions', 4)])
+        root, template, jpy = (uuid.uuid4().hex for i in range(3))
+        con.execute('INSERT INTO books VALUES (?, ?, ?)', (uuid.uuid4().hex, root, template))
+        con.execute("INSERT INTO commodities VALUES (?, 'CURRENCY', 'JPY', 'Japanese Yen', "
+            "'392', 1, 1, 'currency', '')", (jpy,))
+        con.executemany("INSERT INTO accounts VALUES (?, ?, 'ROOT', ?, 1, 0, NULL, '', '', 0, 0)", \
+            [(root, 'Root Account', jpy), (template, 'Template Root', None)])
+    con.close()
+
+
+class BookWriter:
+    '''
+    分割の行をGnuCashのSQLiteの帳簿に直接書き込む。
+
+    csv.writerと同じwriterow/writerowsで，import.csvと同じ列の行を受け取る。
+    Transaction IDのある行から次の取引とし，取引のGUIDにはTransaction IDをそのまま使う。
+    GUIDが決定的なので，同じ取引を再度書き込んでも重複しない (INSERT OR IGNORE)。
+    精算は明細が増えると同じGUIDのまま合計が変わるので，既にあれば分割を書き込む分割で置き換える。
+
+    勘定は起動時に全件を読み込んで 完全な勘定名→勘定 の辞書にしておき，行ごとに引く。
+    ない勘定は親勘定の種類を引き継いで作る。銘柄の勘定 (accounts (Accounts) の銘柄の親勘定の下)
+    はSTOCKの勘定にして，銘柄コードの商品 (名前空間TSE) がなければ作る。
+
+    挿入はBOOK_BATCH行ごとにexecutemanyでまとめ，全体を1つのトランザクションで確定する。
+    '''
+    BOOK_BATCH = 10000
+
+    ## 勘定名の先頭の階層から決める，最上位の勘定の種類。
+    ROOT_TYPE = [('資産', 'ASSET'), ('負債', 'LIABILITY'), ('純資産', 'EQUITY'), \
+        ('収益', 'INCOME'), ('費用', 'EXPENSE')]
+
+    ## 書き込みに使うGnuCashのテーブル。
+    BOOK_TABLES = ('gnclock', 'books', 'commodities', 'accounts', 'transactions', 'splits', 'slots')
+
+    def __init__(self, path, accounts=None):
+        self.stock_parents = (accounts or ACCOUNTS).stock_parents
+        ## 存在しないパスに空のファイルを作らないように，読み書きモードのURIで開く。
+        try:
+            self.con = sqlite3.connect(pathlib.Path(path).resolve().as_uri() + '?mode=rw', \
+                uri=True, isolation_level=None)
+            tables = {name for name, in self.con.execute( \
+                "SELECT name FROM sqlite_master WHERE type = 'table'")}
+        except sqlite3.DatabaseError as error:
+            raise ConversionError('帳簿 {} をSQLiteのデータベースとして開けない: {}'.format(path, error))
+        missing = [table for table in self.BOOK_TABLES if table not in tables]
+        jpy = self.con.execute("SELECT guid FROM commodities " \
+            "WHERE namespace = 'CURRENCY' AND mnemonic = 'JPY'").fetchone() if not missing else None
+        if missing or jpy is None:
+            self.con.close()
+            raise ConversionError('帳簿 {} はGnuCashのSQLiteの帳簿でない ({}がない)'.format( \
+                path, 'テーブル' + '，'.join(missing) if missing else '通貨JPY'))
+        if self.con.execute('SELECT count(*) FROM gnclock').fetchone()[0]:
+            self.con.close()
+            raise ConversionError('帳簿 {} はGnuCashで開かれている'.format(path))
+        self.con.execute('BEGIN')
+
+        self.root = self.con.execute('SELECT root_account_guid FROM books').fetchone()[0]
+        self.jpy = jpy[0]
+        self.commodity = {mnemonic: (guid, fraction) for guid, mnemonic, fraction in \
+            self.con.execute("SELECT guid, mnemonic, fraction FROM commodities " \
+            "WHERE namespace != 'CURRENCY'")}
+
+        ## 完全な勘定名→(GUID, 種類, 商品のGUID, 最小単位) の辞書
+        rows = {guid: row for guid, *row in self.con.execute('SELECT guid, name, parent_guid, ' \
+            'account_type, commodity_guid, commodity_scu FROM accounts')}
+        self.account = {}
+        for guid, (name, parent, account_type, commodity, scu) in rows.items():
+            if account_type == 'ROOT': continue
+            names = [name]
+            while parent in rows and parent != self.root:
+                names.append(rows[parent][0])
+                parent = rows[parent][1]
+            if parent == self.root:
+                self.account[':'.join(reversed(names))] = (guid, account_type, commodity, scu)
+
+        self.transactions, self.splits, self.slots, self.replaced = [], [], [], []
+        self.tx, self.n = None, 0
+        self.created = []
+        self.enter_date = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+    def find_account(self, name):
+        '''完全な勘定名nameの勘定を返す。なければ親勘定から順に作る。'''
+        if name in self.account: return self.account[name]
+
+        parent, sep, leaf = name.rpartition(':')
+        if parent:
+            parent_guid, account_type, commodity, scu = self.find_account(parent)
+        else:
+            parent_guid, commodity, scu = self.root, self.jpy, 1
+            account_type = next((value for key, value in self.ROOT_TYPE if key in leaf), 'ASSET')
+
+        if name.startswith(self.stock_parents) and ' ' in leaf:
+            account_type = 'STOCK'
+            commodity, scu = self.find_commodity(*leaf.split(' ', 1))
+        elif account_type == 'STOCK':
+            account_type, commodity, scu = 'ASSET', self.jpy, 1
+
+        guid = uuid.uuid4().hex
+        self.con.execute("INSERT INTO accounts VALUES (?, ?, ?, ?, ?, 0, ?, '', '', 0, 0)", \
+            (guid, leaf, account_type, commodity, scu, parent_guid))
+        self.account[name] = (guid, account_type, commodity, scu)
+        self.created.append(name)
+        return self.account[name]
+
+    def find_commodity(self, code, name):
+        '''銘柄コードcodeの商品の (GUID, 最小単位) を返す。なければ作る。'''
+        if code not in self.commodity:
+            guid = uuid.uuid4().hex
+            self.con.execute("INSERT INTO commodities VALUES (?, 'TSE', ?, ?, '', 1, 0, NULL, '')", \
+                (guid, code, name))
+            self.commodity[code] = (guid, 1)
+        return self.commodity[code]
+
+    def writerow(self, row):
+        row = dict(zip(header, row))
+        if row['Transaction ID']:
+            date = row['Date'].replace('/', '-')
+            self.tx = row['Transaction ID']
+            self.n = 0
+            self.transactions.append((self.tx, self.jpy, date + ' 10:59:00', self.enter_date, \
+                row['Description']))
+            self.slots.append((self.tx, date.replace('-', ''), self.tx))
+            if row['Description'] == '精算': self.replaced.append((self.tx,))
+
+        guid, account_type, commodity, scu = self.find_account(row['Full Account Name'])
+        amount = float(row['Amount Num.'] or 0)
+        if commodity == self.jpy:
+            value, quantity = round(amount), round(amount)
+        elif row['Rate/Price'] != 1:
+            ## 約定の行: Amount Num.が株数，Rate/Priceが単価 (テンプレートでは約定単価の文字列)
+            value, quantity = round(amount*float(row['Rate/Price'])), round(amount*scu)
+        else:
+            ## 手数料や売買損益の行: 株数は0にして金額だけ記録する。
+            value, quantity = round(amount), 0
+
+        self.splits.append((make_tid(self.tx, self.n), self.tx, guid, row['Memo'], \
+            row['Reconcile'], value, quantity, scu))
+        self.n += 1
+        if len(self.splits) >= self.BOOK_BATCH: self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        self.con.executemany('DELETE FROM splits WHERE tx_guid = ?', self.replaced)
+        self.con.executemany("INSERT OR IGNORE INTO transactions VALUES (?, ?, '', ?, ?, ?)", \
+            self.transactions)
+        self.con.executemany("INSERT OR IGNORE INTO splits VALUES " \
+            "(?, ?, ?, ?, '', ?, NULL, ?, 1, ?, ?, NULL)", self.splits)
+        self.con.executemany("INSERT INTO slots (obj_guid, name, slot_type, int64_val, " \
+            "double_val, numeric_val_num, numeric_val_denom, gdate_val) " \
+            "SELECT ?, 'date-posted', 10, 0, 0.0, 0, 1, ? WHERE NOT EXISTS " \
+            "(SELECT 1 FROM slots WHERE obj_guid = ? AND name = 'date-posted')", self.slots)
+        self.transactions, self.splits, self.slots, self.replaced = [], [], [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+            self.con.execute('COMMIT')
+            for name in self.created:
+                print('勘定を作成した:', name, file=sys.stderr)
+        else:
+            self.con.execute('ROLLBACK')
+        self.con.close()
+
+
+@contextlib.contextmanager
+def replacing(path, encoding='cp932'):
+    '''
+    pathの代わりに末尾に.tmpを付けたファイルを書き込み用に開き，with文が正常に終わったらpathを置き換える。
+
+    例外 (convertの検証のConversionErrorを含む) で終わったら一時ファイルを消し，前回のpathをそのまま残す。
+    '''
+    path = pathlib.Path(path)
+    temporary = path.with_name(path.name + '.tmp')
+    try:
+        with open(temporary, 'w', newline='', encoding=encoding) as f:
+            yield f
+    except BaseException:
+        temporary.unlink()
+        raise
+    temporary.replace(path)
+
+
+## --shardで同時に開いておく分割ファイルの数。これを超えると最も前に使ったファイルを閉じる。
+SHARD_OPEN_FILES = 256
+
+
+class Shards:
+    '''
+    仕訳をimport.csvの代わりに複数のファイル (prefix-キー.csv) に分けて書き込む。
+
+    modeが'day'なら約定日ごと，'stock'なら銘柄コードごと，整数なら約定の取引mode件ごとに分ける。
+    取引 (writerowsに渡す分割の行のリスト) の途中では分けない。keyで約定の行き先を決め，
+    convertはその分割ファイルの約定だけから精算を作ってsettleで同じファイルに書き込むので，
+    ファイルごとに精算まで釣り合う。
+
+    ファイルは必要になったときに開き，SHARD_OPEN_FILESを超えたら閉じて，次は追記で開き直す。
+    書き込み中は末尾に.tmpを付けた名前にしておき，closeで全て閉じてから元の名前に変え，
+    分割ファイルごとの件数と金額の合計の一覧をprefix-manifest.jsonに書き込む。
+    with文が例外で終わったら.tmpのファイルを消す。
+    '''
+    def __init__(self, mode, directory='.', prefix='import'):
+        self.mode = mode
+        self.directory = pathlib.Path(directory)
+        self.prefix = prefix
+        self.shards = {}
+        self.files = collections.OrderedDict()
+        self.transactions = 0
+
+    def key(self, row):
+        '''約定rowを書き込む分割ファイルのキーを返し，その分割ファイルの合計に加える。'''
+        if self.mode == 'day':
+            key = row.約定日.replace('/', '-')
+        elif self.mode == 'stock':
+            key = row.銘柄コード
+        else:
+            key = '{:04d}'.format(self.transactions // self.mode + 1)
+        shard = self.shards.get(key)
+        if shard is None:
+            shard = self.shards[key] = {'file': '{}-{}.csv'.format(self.prefix, key), \
+                'transactions': 0, 'settlements': 0, 'splits': 0, \
+                'first_date': row.約定日, 'last_date': row.約定日, \
+                '取引区分': collections.Counter(), '売買代金': collections.Counter(), \
+                '決済損益': 0, '精算金額': 0}
+        shard['last_date'] = max(shard['last_date'], row.約定日)
+        shard['取引区分'][row.取引区分] += 1
+        shard['売買代金'][row.取引区分] += row.売買代金
+        shard['決済損益'] += int(row.決済損益)
+        return key
+
+    def writer(self, key):
+        '''キーkeyの分割ファイルのcsv.writerを返す。'''
+        if key in self.files:
+            self.files.move_to_end(key)
+            return self.files[key][1]
+        if len(self.files) >= SHARD_OPEN_FILES:
+            self.files.popitem(last=False)[1][0].close()
+        path = self.directory/(self.shards[key]['file'] + '.tmp')
+        new = not self.shards[key]['splits']
+        f = open(path, 'w' if new else 'a', newline='', encoding='cp932')
+        writer = csv.writer(f)
+        if new: writer.writerow(header)
+        self.files[key] = (f, writer)
+        return writer
+
+    def writerows(self, rows, key):
+        if not rows: return
+        self.writer(key).writerows(rows)
+        self.shards[key]['transactions'] += 1
+        self.shards[key]['splits'] += len(rows)
+        self.transactions += 1
+
+    def settle(self, rows, key):
+        '''精算の分割の行rowsをキーkeyの分割ファイルに書き込む。'''
+        self.writer(key).writerows(rows)
+        shard = self.shards[key]
+        shard['settlements'] += 1
+        shard['splits'] += len(rows)
+        shard['精算金額'] += rows[0][AMOUNT_COLUMN]
+        shard['last_date'] = max(shard['last_date'], rows[0][0])
+
+    def close(self):
+        '''分割ファイルを全て閉じ，一覧を書き込んで返す。'''
+        for f, writer in self.files.values():
+            f.close()
+        self.files.clear()
+        shards = [dict(key=key, **shard) for key, shard in self.shards.items() if shard['splits']]
+        for shard in shards:
+            path = self.directory/shard['file']
+            path.with_name(path.name + '.tmp').replace(path)
+        total = {name: sum(shard[name] for shard in shards) \
+            for name in ('transactions', 'settlements', 'splits', '決済損益', '精算金額')}
+        for name in ('取引区分', '売買代金'):
+            total[name] = dict(sum((shard[name] for shard in shards), collections.Counter()))
+        manifest = {'mode': self.mode, 'shards': shards, 'total': total}
+        with open(self.directory/'{}-manifest.json'.format(self.prefix), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+            f.write('\n')
+        return manifest
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for f, writer in self.files.values():
+                f.close()
+            for shard in self.shards.values():
+                path = self.directory/(shard['file'] + '.tmp')
+                if path.exists(): path.unlink()
+
+
+class Stats:
+    '''
+    --statsで出力する段階ごとの時間と件数の記録。
+
+    iterateはジェネレーターを包んで1件ずつの時間を測る。ジェネレーターは入れ子になっているので，
+    innerに内側の段階名を渡すと，出力時に内側の時間を差し引いて，その段階だけの時間にする。
+    callは関数を包んで呼び出しの時間と返した行数 (返り値がなければ渡した行数) を測る。
+    addで直接記録した段階は，行数を渡したときだけ行数を出力する。
+    memoryが真ならtracemallocでメモリーの最大使用量も測る。tracemallocは処理を数倍遅くする。
+    '''
+    def __init__(self, memory=False):
+        self.start = time.perf_counter()
+        self.seconds = collections.Counter()
+        self.rows = collections.Counter()
+        self.inner = {}
+        self.count = {}
+        if memory: tracemalloc.start()
+
+    def add(self, name, seconds, rows=None):
+        self.seconds[name] += seconds
+        if rows is not None: self.rows[name] += rows
+
+    def iterate(self, name, iterable, inner=None):
+        if inner: self.inner[name] = inner
+        self.rows[name] += 0
+        iterator = iter(iterable)
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            try:
+                row = next(iterator)
+            except StopIteration:
+                self.seconds[name] += clock() - start
+                return
+            self.seconds[name] += clock() - start
+            self.rows[name] += 1
+            yield row
+
+    def call(self, name, function):
+        clock = time.perf_counter
+        def timed(*args):
+            start = clock()
+            result = function(*args)
+            self.seconds[name] += clock() - start
+            self.rows[name] += len(args[0] if result is None else result)
+            return result
+        return timed
+
+    def dump(self, path):
+        '''記録をJSONにしてpathに書き込む。pathが'-'なら標準エラー出力に書き込む。'''
+        total = time.perf_counter() - self.start
+        peak = None
+        if tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        stages = {}
+        for name in self.seconds:
+            seconds = self.seconds[name] - self.seconds.get(self.inner.get(name), 0)
+            stages[name] = {'seconds': round(seconds, 6)}
+            if name in self.rows: stages[name]['rows'] = self.rows[name]
+        trades = self.rows.get('parse', 0)
+        result = {'seconds': round(total, 6), 'stages': stages,
+            'rows_per_sec': round(trades/total) if total else None,
+            **self.count, 'tracemalloc_peak': peak}
+        text = json.dumps(result, ensure_ascii=False, indent=1)
+        if path == '-':
+            print(text, file=sys.stderr)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text + '\n')
+
+
+def find_files(directory='.', merge=False, pattern='*.csv'):
+    '''
+    directoryのpatternに合う*.csvから明細を識別し，タイトルごとの [(パス, 読み飛ばす最後の日)] の辞書を返す。
+
+    同じ種類の明細が複数あれば，mergeが真なら全て結合し，偽ならpick_fileで1個を選ぶ。
+    株式約定履歴と信用決済履歴が見つからなければ既定のファイル名を使う。
+    '''
+    found = discover(directory, pattern=pattern)
+    files = {}
+    for title, default in zip(TITLES, (trade_csv, pay_csv, None)):
+        candidates = found[title]
+        if not candidates:
+            files[title] = [(str(pathlib.Path(directory)/default), '')] if default else []
+        elif merge:
+            files[title] = merge_periods(candidates)
+        else:
+            path = pick_file(candidates)[0]
+            if len(candidates) > 1:
+                print('警告: {}が{}個あるので{}を使う (--mergeで全て結合する)'.format( \
+                    title, len(candidates), path), file=sys.stderr)
+            files[title] = [(path, '')]
+    return files
+
+
+def read_files(files, stats=None):
+    '''
+    find_filesの明細を読み込む。
+
+    譲渡益税履歴と信用決済履歴は全て読んで索引にし，株式約定履歴は列名だけ読んで残りはジェネレーターにする。
+    出力を開く前に呼んで，明細がない場合などに出力を空にしないようにする。
+    戻り値は (株式約定履歴の列名, Tradeのジェネレーター, 信用決済履歴の索引, 金額の異なるキーの集合,
+    譲渡益税履歴の明細の索引, 受渡日ごとの譲渡益税, 冒頭の決済損益合計と譲渡益税徴収額合計の辞書)。
+    '''
+    ## 譲渡益税履歴はなくてもよい。
+    tax_index, tax = None, None
+    totals = {}
+    if files['譲渡益税履歴']:
+        start = time.perf_counter()
+        tax_index, tax = read_taxes(files['譲渡益税履歴'], totals)
+        if stats: stats.add('parse_tax', time.perf_counter() - start)
+
+    start = time.perf_counter()
+    trade_header, trade = read_trades(files['株式約定履歴'])
+    if stats: stats.add('header', time.perf_counter() - start)
+
+    start = time.perf_counter()
+    index, ambiguous = index_pay(read_pays(files['信用決済履歴'], totals))
+    if stats: stats.add('parse_pay', time.perf_counter() - start, \
+        sum(map(len, index.values())))
+    return trade_header, trade, index, ambiguous, tax_index, tax, totals
+
+
+class Converter:
+    '''
+    明細の変換。parse (読み込み)，match (突き合わせから在庫まで)，emit (仕訳の作成と書き出し) に分かれる。
+
+    勘定の設定 (Accounts) のコンパイル済みのテンプレートと銘柄の勘定名，営業日カレンダーの計算結果は
+    インスタンスに持つので，常駐するプロセスで1個のConverterを使い回せば，呼び出しごとに作り直さない。
+    accounts (Accounts) を省略すると既定の勘定 (ACCOUNTS) を使う。
+    '''
+    def __init__(self, accounts=None, chunk_rows=SORT_CHUNK_ROWS):
+        self.accounts = accounts or ACCOUNTS
+        self.chunk_rows = chunk_rows
+        self.calendar = None
+
+    def parse(self, directory='.', merge=False, pattern='*.csv', stats=None):
+        '''directoryの明細を識別して読み込み，read_filesの戻り値を返す。'''
+        start = time.perf_counter()
+        files = find_files(directory, merge, pattern)
+        if stats: stats.add('discovery', time.perf_counter() - start)
+        return read_files(files, stats)
+
+    def match(self, inputs, report, con=None, lots=None, stats=None, new=None, salt=()):
+        '''
+        parseで読み込んだ約定を信用決済履歴と突き合わせて並べ替え，(Transaction ID, Trade) を1件ずつ返す。
+
+        con (open_storeの接続) を渡すと変換済みの約定を除き，新しい約定の (Transaction ID, 約定日) をnewに追加する。
+        lots (Lots) を渡すと，約定を順にlotsに通して実現損益を計算する。
+        salt (値のタプル) はTransaction IDの元に加える (tid_trade)。
+        突き合わせの結果はreport (new_reportの辞書) に追加する。
+        '''
+        trade_header, trade, index, ambiguous, tax_index, tax, expected = inputs
+        ## 読み込みから書き出しまでを1行ずつのジェネレーターでつなぎ，全行をメモリーに持たない。
+        if stats: trade = stats.iterate('parse', trade)
+        trade = calc_trade(trade, index, ambiguous, report, tax_index)
+        if stats: trade = stats.iterate('match', trade, 'parse')
+        trade = tid_trade(sort_trade(trade, self.chunk_rows), salt)
+        if stats: trade = stats.iterate('sort', trade, 'match')
+        if con is not None:
+            trade = skip_stored(trade, con, new if new is not None else [])
+            if stats: trade = stats.iterate('incremental', trade, 'sort')
+        if lots is not None:
+            inner = 'sort' if con is None else 'incremental'
+            trade = track_lots(trade, lots, report)
+            if stats: trade = stats.iterate('lots', trade, inner)
+        return trade
+
+    def emit(self, inputs, trade, report, list_file, import_writer, settlement_writer=None, \
+            shards=None, stats=None, complete=True, salt=(), taxed=None):
+        '''
+        matchの約定tradeから仕訳を作り，list_fileに一覧を，import_writerに仕訳を書き込む。
+
+        import_writerはcsv.writerかBookWriterのようにwriterowsで行のリストを受け取るもの (shardsを渡すならNone)。
+        settlement_writerを渡すと，精算の仕訳はimport_writerの代わりにそちらに書き込む。
+        shards (Shards) を渡すと，import_writerの代わりにshardsの分割ファイルに書き込み，
+        分割ファイルごとに精算を作る。精算日の譲渡益税はその精算日の最初の分割ファイルの精算にだけ入れる。
+        taxed (精算日の集合) を渡すと，その精算日の譲渡益税は入れず (前回までに入れた精算日)，
+        譲渡益税を入れた精算日をtaxedに追加する。
+        最後に突き合わせの警告を表示する。
+
+        取引は書き込む前にBalanceで釣り合いを確かめ，completeが真なら最後に決済損益と譲渡益税の合計を
+        明細の冒頭と照合する (変換済みの約定を除いたときは偽にする)。
+        合わなければConversionErrorで中断するので，呼ぶ側は出力を一時ファイルに書き，正常に終わってから置き換える。
+        精算のTransaction IDはsalt (matchと同じ値) と精算日と分割ファイルのキーから作る。completeが偽なら前回までに書き込んだ，
+        saltがあれば同じ口座の他のジョブの同じ精算日の精算と区別するため，その精算日の最初の約定のTransaction IDも加える。
+        '''
+        trade_header, _, index, ambiguous, tax_index, tax, expected = inputs
+        if self.calendar is None: self.calendar = Calendar()
+        calendar = self.calendar
+        ## 約定が1件もなくてもimport.csvと同じように列名の行は書き込む。
+        list_writer = csv.writer(list_file)
+        list_writer.writerow(trade_header + LIST_EXTRA)
+        i_profit = trade_header.index('決済損益')
+        split, settlement = self.accounts.make_split, self.accounts.make_settlement
+        balance = Balance(self.accounts)
+        check = balance.check
+        if shards is None:
+            write = import_writer.writerows
+            write_settlement = (settlement_writer or import_writer).writerows
+        else:
+            write, write_settlement = shards.writerows, shards.settle
+        if stats:
+            kinds = collections.Counter()
+            split = stats.call('split', split)
+            settlement = stats.call('split', settlement)
+            write = stats.call('write', write)
+            write_settlement = stats.call('write', write_settlement)
+            check = stats.call('check', check)
+
+        ## 分割ファイル (分けなければNone) と精算日ごとに取引区分ごとの売買代金を集計する。
+        totals = collections.defaultdict(dict)
+        contexts = {}
+        key = None
+        for tid, row in trade:
+            if stats: kinds[row.取引区分] += 1
+            list_writer.writerow(list_row(row, i_profit))
+
+            if shards is not None: key = shards.key(row)
+            if row.取引区分 in SETTLEMENT_KINDS:
+                pay_date = settle_date(row, calendar, report)
+                total = totals[key]
+                if pay_date not in total:
+                    total[pay_date] = dict.fromkeys(SETTLEMENT_KINDS, 0)
+                    contexts[key, pay_date] = salt + ((key,) if shards is not None else ()) \
+                        + (() if complete and not salt else (tid,))
+                total[pay_date][row.取引区分] += row.売買代金
+            rows = split(row, tid)
+            check(rows, row)
+            if shards is None:
+                write(rows)
+            else:
+                write(rows, key)
+
+        ## 精算: 分割ファイルごと，精算日ごとに1件ずつ作る。
+        if taxed is None: taxed = set()
+        for key, total in totals.items():
+            for pay_date in sorted(total):
+                rows = settlement(pay_date, total[pay_date], None if pay_date in taxed else tax, \
+                    contexts[key, pay_date])
+                if pay_date in tax: taxed.add(pay_date)
+                check(rows, pay_date)
+                if shards is None:
+                    write_settlement(rows)
+                else:
+                    write_settlement(rows, key)
+
+        report_pay(index, report)
+        ## 対応しなかった決済と精算のない受渡日の譲渡益税は仕訳にならないので，冒頭の合計から除いて照合する。
+        if complete:
+            profit, tax_total = expected.get('決済損益合計'), expected.get('譲渡益税徴収額合計')
+            if profit is not None:
+                profit -= sum(int(row['決済損益']) for rows in index.values() for row in rows)
+            if tax_total is not None:
+                tax_total -= sum(sum(value) for date, value in tax.items() if date not in taxed)
+            balance.finish(profit, tax_total)
+        if stats:
+            stats.count.update({'取引区分': dict(kinds), 'splits': stats.rows['split'],
+                'settlements': sum(map(len, totals.values())),
+                **{key: len(value) for key, value in report.items()},
+                'unmatched_pay': sum(map(len, index.values()))})
+
+    def convert(self, inputs, list_file, import_writer, con=None, stats=None, \
+            settlement_writer=None, lots=None, shards=None, salt=(), taxed=None):
+        '''
+        parseで読み込んだ明細をmatchとemitで変換する。
+
+        con (open_storeの接続) を渡すと変換済みの約定を除き，新しい約定の [(Transaction ID, 約定日)] を返す。
+        その他の引数はmatchとemitと同じ。
+        '''
+        report = new_report()
+        new = []
+        trade = self.match(inputs, report, con, lots, stats, new, salt)
+        self.emit(inputs, trade, report, list_file, import_writer, settlement_writer, shards, stats, \
+            complete=con is None, salt=salt, taxed=taxed)
+        return new
+
+
+def new_report():
+    '''calc_tradeなどが突き合わせの結果を追加するreportの辞書を作る。'''
+    return {'unmatched': [], 'ambiguous': [], 'untaxed': [], 'delivery': [], 'short': []}
+
+
+@functools.lru_cache(maxsize=None)
+def job_converter(accounts_file, chunk_rows):
+    '''--batchのワーカーのConverter。同じワーカーが続けて変換するジョブで使い回す。'''
+    return Converter(load_accounts(accounts_file) if accounts_file else None, chunk_rows)
+
+
+def split_job(job):
+    '''
+    --batchのジョブをfind_filesの (ディレクトリー, パターン) にする。
+
+    ディレクトリーならその中の*.csvを，そうでなければ 'ディレクトリー/2020-*.csv' のようなパターンとみなす。
+    '''
+    path = pathlib.Path(job)
+    if path.is_dir(): return path, '*.csv'
+    return path.parent, path.name
+
+
+def job_account(job):
+    '''--batchのジョブの口座 (ジョブのディレクトリーの親ディレクトリー，パターンならそのディレクトリー) の絶対パスを返す。'''
+    directory, pattern = split_job(job)
+    return (directory.parent if pattern == '*.csv' else directory).resolve()
+
+
+def convert_job(job, part, chunk_rows=SORT_CHUNK_ROWS, merge=False, accounts_file=None, salt=()):
+    '''
+    --batchの1件のジョブを変換し，part + '-list.csv'，'-trade.csv'，'-settlement.csv'，'-position.csv' に書き込む。
+
+    単独の変換と同じ仕訳になるように，ジョブごとの在庫 (Lots) に通して実現損益を計算する。
+    マージしたimport.csvで他の口座とTransaction IDが重ならないように，IDにはsalt (batchでは口座の絶対パス) を加える。
+    accounts_fileがあれば，ワーカーごとにその勘定の設定を読み込んで使う (job_converter)。
+
+    プロセスプールのワーカーで実行する。1件の失敗で他のジョブを止めないように，変換できない明細の
+    ConversionErrorと読めないファイルのOSErrorは捕まえ，(標準エラー出力に出した警告, エラーのメッセージかNone) を返す。
+    '''
+    stderr = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(stderr):
+            converter = job_converter(accounts_file, chunk_rows)
+            directory, pattern = split_job(job)
+            inputs = converter.parse(directory, merge, pattern)
+            lots = Lots()
+            with open(part + '-list.csv', 'w', newline='', encoding='utf-8') as list_file, \
+                 open(part + '-trade.csv', 'w', newline='', encoding='utf-8') as trade_file, \
+                 open(part + '-settlement.csv', 'w', newline='', encoding='utf-8') as settlement_file:
+                converter.convert(inputs, list_file, csv.writer(trade_file), \
+                    settlement_writer=csv.writer(settlement_file), lots=lots, salt=salt)
+            with open(part + '-position.csv', 'w', newline='', encoding='utf-8') as position_file:
+                csv.writer(position_file).writerows(lots.rows())
+    except (ConversionError, OSError) as error:
+        return stderr.getvalue(), str(error) or repr(error)
+    return stderr.getvalue(), None
+
+
+def read_transactions(path):
+    '''import.csvの形式のファイルから取引 (先頭の行にDateがある分割の行のリスト) を1件ずつ返す。'''
+    with open(path, newline='', encoding='utf-8') as f:
+        transaction = []
+        for row in csv.reader(f):
+            if row[0] and transaction:
+                yield transaction
+                transaction = []
+            transaction.append(row)
+        if transaction: yield transaction
+
+
+def read_list(path):
+    '''convert_jobのlist.csvの行を列名の行を除いて1行ずつ返す。'''
+    with open(path, newline='', encoding='utf-8') as f:
+        yield from itertools.islice(csv.reader(f), 1, None)
+
+
+def read_part(path):
+    '''convert_jobの列名の行のない部分ファイルの行を1行ずつ返す。'''
+    with open(path, newline='', encoding='utf-8') as f:
+        yield from csv.reader(f)
+
+
+def merge_parts(parts, directory='.'):
+    '''
+    convert_jobの出力を日付順にマージして，directoryのlist.csvとimport.csvとposition.csvに書き込む。
+
+    株式約定履歴の取引を約定日順に並べた後に精算を精算日順に並べ，日付が同じならpartsの順にする。
+    在庫はジョブごとのものを (種類, 銘柄コード) 順に並べる。
+    一度に開くのは1種類の部分ファイルだけにする。
+    Transaction IDが重なる取引 (期間の重なった明細を別のジョブで変換したなど) があればConversionErrorで中断し，
+    replacingで書き込むので前回の出力をそのまま残す。
+    '''
+    directory = pathlib.Path(directory)
+    trade_header = None
+    for part in parts:
+        with open(part + '-list.csv', newline='', encoding='utf-8') as f:
+            trade_header = next(csv.reader(f), None)
+        if trade_header: break
+
+    first_date = lambda transaction: transaction[0][0]
+    seen = set()
+    ## 重なりで中断したら3個とも前回のまま残すように，まとめて置き換える。
+    with replacing(directory/'import.csv') as import_file, \
+         replacing(directory/'list.csv') as list_file, \
+         replacing(directory/'position.csv') as position_file:
+        import_writer = csv.writer(import_file)
+        import_writer.writerow(header)
+        for kind in ('-trade.csv', '-settlement.csv'):
+            for transaction in heapq.merge(*(read_transactions(part + kind) for part in parts), \
+                    key=first_date):
+                tid = transaction[0][1]
+                if tid in seen:
+                    raise ConversionError('{} の複数のジョブに同じTransaction ID {} の取引 ({} {}) がある'.format( \
+                        directory/'import.csv', tid, transaction[0][0], transaction[0][3]))
+                seen.add(tid)
+                import_writer.writerows(transaction)
+
+        if trade_header:
+            list_writer = csv.writer(list_file)
+            list_writer.writerow(trade_header)
+            list_writer.writerows(heapq.merge(*(read_list(part + '-list.csv') for part in parts), \
+                key=operator.itemgetter(0)))
+
+        position_writer = csv.writer(position_file)
+        position_writer.writerow(POSITION_HEADER)
+        position_writer.writerows(heapq.merge(*(read_part(part + '-position.csv') for part in parts), \
+            key=operator.itemgetter(0, 1)))
+
+
+def batch(jobs, chunk_rows=SORT_CHUNK_ROWS, merge=False, processes=None, per_account=False, \
+        accounts_file=None):
+    '''
+    複数のジョブ (ディレクトリーかパターン) をプロセスプールで並列に変換し，1個のimport.csvにまとめる。
+
+    per_accountが真なら，ジョブのディレクトリーの親ディレクトリー (パターンならそのディレクトリー) を
+    口座とみなし，口座ごとにそのディレクトリーにlist.csvとimport.csvを書き込む。偽ならカレントディレクトリーに書き込む。
+    Transaction IDには口座の絶対パスを加えるので，口座が違えば同じ内容の約定も別の取引になり，
+    同じ口座ならジョブの指定の書き方や月ごとのディレクトリーの分け方によらず同じIDになる。
+    失敗したジョブは出力から除いて他のジョブだけをまとめ，失敗したジョブの数を返す。
+    全てのジョブが失敗した出力先は書き込まず，前回の出力をそのまま残す。
+    '''
+    accounts = [job_account(job) for job in jobs]
+    outputs = collections.defaultdict(list)
+    for number, account in enumerate(accounts):
+        outputs[account if per_account else pathlib.Path('.')].append(number)
+
+    import concurrent.futures
+    failed = set()
+    with tempfile.TemporaryDirectory() as work:
+        parts = [str(pathlib.Path(work)/str(number)) for number in range(len(jobs))]
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            futures = [executor.submit(convert_job, job, part, chunk_rows, merge, accounts_file, \
+                (str(account),)) for job, part, account in zip(jobs, parts, accounts)]
+            for number, (job, future) in enumerate(zip(jobs, futures)):
+                try:
+                    output, error = future.result()
+                except Exception as exception:
+                    output, error = '', str(exception) or repr(exception)
+                for line in output.splitlines():
+                    print('{}: {}'.format(job, line), file=sys.stderr)
+                if error:
+                    print('エラー: {} の変換に失敗した: {}'.format(job, error), file=sys.stderr)
+                    failed.add(number)
+
+        for account, numbers in outputs.items():
+            numbers = [number for number in numbers if number not in failed]
+            if not numbers: continue
+            try:
+                merge_parts([parts[number] for number in numbers], account)
+            except ConversionError as error:
+                print('エラー: {}'.format(error), file=sys.stderr)
+                failed.update(numbers)
+    return len(failed)
@@ -0,0 +1,10 @@
+# coding: utf-8
+## \file      __main__.py
+## \author    SENOO, Ken
+## \copyright CC0
+
+'''python3 -m gnucash_import_stockで実行する。'''
+
+from gnucash_import_stock.cli import main
+
+main()
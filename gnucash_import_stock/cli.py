@@ -0,0 +1,126 @@
+# coding: utf-8
+## \file      cli.py
+## \author    SENOO, Ken
+## \copyright CC0
+
+'''
+gnucash-import-stock.pyとpython3 -m gnucash_import_stockのコマンドライン。
+
+引数を解釈してConverterなどを呼ぶだけで，変換の処理はgnucash_import_stockにある。
+ライブラリーが送出するConversionErrorは，ここでエラーのメッセージにして終了する。
+'''
+
+import argparse
+import csv
+import pathlib
+import sys
+
+from gnucash_import_stock import ACCOUNTS, ACCOUNTS_FILE, POSITION_HEADER, SORT_CHUNK_ROWS, STORE_DB, \
+    BookWriter, ConversionError, Converter, Lots, Shards, Stats, batch, header, load_accounts, open_store, \
+    replacing
+
+
+def shard_mode(value):
+    '''--shardの値をShardsのmodeにする。'''
+    if value in ('day', 'stock'): return value
+    try:
+        count = int(value)
+    except ValueError:
+        count = 0
+    if count <= 0:
+        raise argparse.ArgumentTypeError('day，stockか正の整数を指定する: {}'.format(value))
+    return count
+
+
+def main():
+    try:
+        run()
+    except ConversionError as error:
+        raise SystemExit('エラー: {}'.format(error))
+
+
+def run():
+    parser = argparse.ArgumentParser(description='岡三オンライン証券の取引明細をGnuCashへのインポート用データに変換する。')
+    parser.add_argument('--chunk-rows', type=int, default=SORT_CHUNK_ROWS,
+        help='ソート時に1回にメモリーに載せる行数 (既定値: %(default)s)')
+    parser.add_argument('--incremental', action='store_true',
+        help='前回までに変換済みの約定を除いて，新しい約定だけを出力する')
+    parser.add_argument('--store', default=STORE_DB,
+        help='--incrementalで変換済みの約定を記録するファイル (既定値: %(default)s)')
+    parser.add_argument('--book',
+        help='import.csvの代わりにGnuCashのSQLiteの帳簿ファイルに直接書き込む')
+    parser.add_argument('--stats', nargs='?', const='-', metavar='FILE',
+        help='段階ごとの時間と件数をJSONでFILE (省略時は標準エラー出力) に書き込む')
+    parser.add_argument('--stats-memory', action='store_true',
+        help='--statsにtracemallocで測ったメモリーの最大使用量を含める (処理は数倍遅くなる)')
+    parser.add_argument('--merge', action='store_true',
+        help='同じ種類の明細が複数あれば，1個を選ぶ代わりに検索期間順に全て結合する')
+    parser.add_argument('--batch', nargs='+', metavar='JOB',
+        help='カレントディレクトリーの代わりに，複数のディレクトリー (か\'2020/*.csv\'のようなパターン) の明細を並列に変換して1個のimport.csvにまとめる')
+    parser.add_argument('--jobs', type=int,
+        help='--batchで並列に実行するプロセス数 (既定値: CPU数)')
+    parser.add_argument('--per-account', action='store_true',
+        help='--batchでジョブの親ディレクトリーを口座とみなし，口座ごとにimport.csvを書き込む')
+    parser.add_argument('--shard', type=shard_mode, metavar='{N,day,stock}',
+        help='import.csvの代わりに，取引N件ごと，約定日ごと (day) か銘柄ごと (stock) のimport-*.csvに分けて書き込む')
+    parser.add_argument('--accounts', metavar='FILE',
+        help='勘定の設定ファイル (JSONかTOML。既定値: カレントディレクトリーに{}があればそれ)'.format(ACCOUNTS_FILE))
+    args = parser.parse_args()
+    if args.accounts is None and pathlib.Path(ACCOUNTS_FILE).exists():
+        args.accounts = ACCOUNTS_FILE
+    ## 設定の誤りは--batchでもワーカーを起動する前に報告する。
+    accounts = load_accounts(args.accounts) if args.accounts else ACCOUNTS
+
+    if args.batch:
+        if args.book or args.incremental or args.stats or args.shard:
+            parser.error('--batchは--book，--incremental，--stats，--shardと併用できない')
+        sys.exit(1 if batch(args.batch, args.chunk_rows, args.merge, args.jobs, args.per_account, \
+            args.accounts) else 0)
+
+    if args.book and args.shard:
+        parser.error('--bookは--shardと併用できない')
+    stats = Stats(args.stats_memory) if args.stats else None
+
+    ## *.csvファイルから株式約定履歴・信用決済履歴・譲渡益税履歴を識別して読み込む。
+    converter = Converter(accounts, args.chunk_rows)
+    inputs = converter.parse(merge=args.merge, stats=stats)
+
+    con = open_store(args.store) if args.incremental else None
+    lots = Lots()
+    if con: lots.load(con)
+    ## 譲渡益税を前回までの精算に入れた精算日。同じ精算日の新しい精算には入れない。
+    taxed = {date for date, in con.execute('SELECT date FROM tax')} if con else None
+    ## 検証で中断したら前回の出力を残すように，一時ファイルに書いて最後に置き換える。
+    with replacing('list.csv') as list_file, \
+         (BookWriter(args.book, accounts) if args.book else Shards(args.shard) if args.shard else \
+          replacing('import.csv')) as import_file:
+        shards = None
+        if args.book:
+            import_writer = import_file
+        elif args.shard:
+            import_writer, shards = None, import_file
+        else:
+            import_writer = csv.writer(import_file)
+            import_writer.writerow(header)
+        new = converter.convert(inputs, list_file, import_writer, con, stats, lots=lots, shards=shards, \
+            taxed=taxed)
+    with open('position.csv', 'w', newline='', encoding='cp932') as position_file:
+        position_writer = csv.writer(position_file)
+        position_writer.writerow(POSITION_HEADER)
+        position_writer.writerows(lots.rows())
+
+    ## 出力が全て書き終わってから変換済みとして記録し，在庫のスナップショットを保存する。
+    if args.incremental:
+        with con:
+            con.executemany('INSERT OR IGNORE INTO trade (tid, date) VALUES (?, ?)', new)
+            con.executemany('INSERT OR IGNORE INTO tax (date) VALUES (?)', ((date,) for date in taxed))
+            lots.save(con)
+        con.close()
+        print('新しい約定: {}件'.format(len(new)), file=sys.stderr)
+    if stats:
+        stats.count['実現損益'] = lots.realized
+        stats.dump(args.stats)
+
+
+if __name__ == '__main__':
+    main()